@@ -6,7 +6,9 @@ set -e
 SCRIPT_DIR=$( cd -- "$( dirname -- "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )
 DOCKER_IMAGE_TAG="example-algorithm-closed-testing-phase"
 
+# The shared rare25 package is passed in as an additional build context
 docker build \
   --platform=linux/amd64 \
   --tag "$DOCKER_IMAGE_TAG"  \
+  --build-context core="${SCRIPT_DIR}/../../core" \
   "$SCRIPT_DIR" 2>&1
@@ -15,117 +15,47 @@ To save the container and prep it for upload to Grand-Challenge.org you can call
 
 Any container that shows the same behaviour will do, this is purely an example of how one COULD do it.
 
+The shared code lives in the rare25 package (see core/ in the repository root),
+this script only configures it for this phase.
+
 Reference the documentation to get details on the runtime environment on the platform:
 https://grand-challenge.org/documentation/runtime-environment/
 
 Happy programming!
 """
 
-from pathlib import Path
-import json
-from glob import glob
-import SimpleITK
-import numpy
-
-INPUT_PATH = Path("/input")
-OUTPUT_PATH = Path("/output")
-RESOURCE_PATH = Path("resources")
-
-
-def run():
-    # The key is a tuple of the slugs of the input sockets
-    interface_key = get_interface_key()
-
-    # Lookup the handler for this particular set of sockets (i.e. the interface)
-    handler = {
-        ("stacked-barretts-esophagus-endoscopy-images",): interface_0_handler,
-    }[interface_key]
-
-    # Call the handler
-    return handler()
+from functools import partial
 
+from rare25 import INTERFACE_0, algorithm
+from rare25.algorithm import RESOURCE_PATH
 
-def interface_0_handler():
-    # Read the input
-    input_stacked_barretts_esophagus_endoscopy_images = load_image_file_as_array(
-        location=INPUT_PATH / "images/stacked-barretts-esophagus-endoscopy",
-    )
-
-    # Process the inputs: any way you'd like
-    _show_torch_cuda_info()
-
-    # Some additional resources might be required, include these in one of two ways.
-
-    # Option 1: part of the Docker-container image: resources/
-    resource_dir = Path("/opt/app/resources")
-    with open(resource_dir / "some_resource.txt", "r") as f:
-        print(f.read())
+# Keyword arguments of the TimmClassificationModel
+MODEL = dict(
+    model_name="resnet50",
+    num_classes=1,
+    weights=RESOURCE_PATH / "resnet50.pth",
+    batch_size=32,
+    # Test-time augmentation, e.g. ("hflip", "vflip", "rot10", "rot-10", "crop0.875")
+    tta=(),
+    tta_aggregation="mean_logit",
+    # A directory to cache features and logits of repeated frames in, e.g. for local runs
+    embedding_cache=None,
+)
 
-    # Option 2: upload them as a separate tarball to Grand Challenge (go to your Algorithm > Models). The resources in the tarball will be extracted to `model_dir` at runtime.
-    model_dir = Path("/opt/ml/model")
-    with open(
-        model_dir / "a_tarball_subdirectory" / "some_tarball_resource.txt", "r"
-    ) as f:
-        print(f.read())
-
-    # For now, let us make bogus predictions
-    output_stacked_neoplastic_lesion_likelihoods = [0.1, 0.5, 0.3, 1.0]
-
-    # Save your output
-    write_json_file(
-        location=OUTPUT_PATH / "stacked-neoplastic-lesion-likelihoods.json",
-        content=output_stacked_neoplastic_lesion_likelihoods,
-    )
+# When present, the ensemble described by this manifest is used instead of MODEL
+ENSEMBLE_MANIFEST = RESOURCE_PATH / "ensemble.json"
 
-    return 0
 
-
-def get_interface_key():
-    # The inputs.json is a system generated file that contains information about
-    # the inputs that interface with the algorithm
-    inputs = load_json_file(
-        location=INPUT_PATH / "inputs.json",
-    )
-    socket_slugs = [sv["interface"]["slug"] for sv in inputs]
-    return tuple(sorted(socket_slugs))
-
-
-def load_json_file(*, location):
-    # Reads a json file
-    with open(location, "r") as f:
-        return json.loads(f.read())
-
-
-def write_json_file(*, location, content):
-    # Writes a json file
-    with open(location, "w") as f:
-        f.write(json.dumps(content, indent=4))
-
-
-def load_image_file_as_array(*, location):
-    # Use SimpleITK to read a file
-    input_files = (
-        glob(str(location / "*.tif"))
-        + glob(str(location / "*.tiff"))
-        + glob(str(location / "*.mha"))
+def run():
+    return algorithm.run(
+        handlers={
+            INTERFACE_0: partial(
+                algorithm.interface_0_handler,
+                model=MODEL,
+                ensemble_manifest=ENSEMBLE_MANIFEST,
+            ),
+        }
     )
-    result = SimpleITK.ReadImage(input_files[0])
-
-    # Convert it to a Numpy array
-    return SimpleITK.GetArrayFromImage(result)
-
-
-def _show_torch_cuda_info():
-    import torch
-
-    print("=+=" * 10)
-    print("Collecting Torch CUDA information")
-    print(f"Torch CUDA is available: {(available := torch.cuda.is_available())}")
-    if available:
-        print(f"\tnumber of devices: {torch.cuda.device_count()}")
-        print(f"\tcurrent device: { (current_device := torch.cuda.current_device())}")
-        print(f"\tproperties: {torch.cuda.get_device_properties(current_device)}")
-    print("=+=" * 10)
 
 
 if __name__ == "__main__":
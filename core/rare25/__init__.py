@@ -0,0 +1,30 @@
+"""
+Shared code of the RARE25 challenge phases.
+
+The phase directories (sanity-check, open-development-phase and
+closed-testing-phase) only configure these modules:
+
+  * rare25.io          reading and writing the inputs and outputs
+  * rare25.algorithm   running an algorithm container
+  * rare25.timm_model  the example timm classification model
+  * rare25.ensemble    an ensemble of timm models sharing one preprocessed stack
+  * rare25.embedding_cache  an on-disk cache of features and logits of frames
+  * rare25.features    extracting backbone features for head-only iteration
+  * rare25.dataset     training Datasets over the batch TIFFs and the pre-decoded shards
+  * rare25.evaluation  running an evaluation container
+  * rare25.local       evaluating a model end to end without Docker
+  * rare25.worker      a long-lived worker that batches frames across stacks
+  * rare25.metrics     the leaderboard metrics
+  * rare25.delong      analytical, patient-clustered AUROC confidence intervals
+  * rare25.result_cache  a cache of processed evaluation jobs
+  * rare25.columns     out-of-core frame columns for very large evaluations
+  * rare25.processing  the pool that processes the algorithm jobs
+  * rare25.upload      uploading cases to an archive
+  * rare25.archive_stand_in  a local stand-in of the archive API, to try the upload
+
+Heavy dependencies (torch, scikit-learn, gcapi) are only imported by the
+modules that need them, so importing the package itself is cheap.
+"""
+
+# The interface of the RARE25 algorithms: the slugs of its input sockets
+INTERFACE_0 = ("stacked-barretts-esophagus-endoscopy-images",)
@@ -0,0 +1,122 @@
+"""
+Runs an algorithm container: looks up the interface from /input/inputs.json
+and calls the handler that belongs to it.
+"""
+
+from pathlib import Path
+
+from rare25.instrumentation import timings
+from rare25.io import load_image_stack, load_json_file, write_json_file
+
+INPUT_PATH = Path("/input")
+OUTPUT_PATH = Path("/output")
+RESOURCE_PATH = Path("resources")
+
+# The likelihoods are written as compact json, this is the largest output of a job
+LIKELIHOODS_INDENT = None
+
+# Set RARE25_WRITE_TIMINGS to profile and write the per-stage timings to /output/timings.json as well
+WRITE_TIMINGS = timings.profile
+
+
+def run(*, handlers):
+    # The key is a tuple of the slugs of the input sockets
+    with timings.stage("interface lookup"):
+        interface_key = get_interface_key()
+
+    # Lookup the handler for this particular set of sockets (i.e. the interface)
+    handler = handlers[interface_key]
+
+    # Call the handler
+    try:
+        return handler()
+    finally:
+        timings.report()
+        if WRITE_TIMINGS:
+            timings.write(location=OUTPUT_PATH / "timings.json")
+
+
+def interface_0_handler(*, model, ensemble_manifest=None, classifier=None):
+    """
+    Predicts the neoplastic lesion likelihood of every frame in the input stack
+
+    `model` holds the keyword arguments of TimmClassificationModel. If the
+    `ensemble_manifest` file exists, the ensemble it describes is used instead
+    (see rare25.ensemble). An already built `classifier` takes precedence over both.
+    """
+    # Read the input, all files of the socket form one sequence of frames
+    with timings.stage("image load"):
+        input_stacked_barretts_esophagus_endoscopy_images = load_image_stack(
+            location=INPUT_PATH / "images/stacked-barretts-esophagus-endoscopy",
+        )
+    print_stack_layout(input_stacked_barretts_esophagus_endoscopy_images)
+    # Process the inputs: any way you'd like
+    show_torch_cuda_info()
+
+    # Model construction and weight load are timed by the model itself
+    if classifier is None:
+        classifier = build_classifier(model=model, ensemble_manifest=ensemble_manifest)
+
+    predict_stack(
+        classifier=classifier,
+        stack=input_stacked_barretts_esophagus_endoscopy_images,
+        output_path=OUTPUT_PATH,
+    )
+
+    return 0
+
+
+def predict_stack(*, classifier, stack, output_path):
+    output_stacked_neoplastic_lesion_likelihoods = classifier.predict(stack)
+
+    # Save your output
+    with timings.stage("json write"):
+        write_json_file(
+            location=Path(output_path) / "stacked-neoplastic-lesion-likelihoods.json",
+            content=output_stacked_neoplastic_lesion_likelihoods,
+            indent=LIKELIHOODS_INDENT,
+        )
+
+    return output_stacked_neoplastic_lesion_likelihoods
+
+
+def build_classifier(*, model, ensemble_manifest=None):
+    if ensemble_manifest is not None and Path(ensemble_manifest).is_file():
+        from rare25.ensemble import EnsembleModel
+
+        print(f"Using the ensemble of {ensemble_manifest}")
+        return EnsembleModel.from_manifest(ensemble_manifest)
+
+    from rare25.timm_model import TimmClassificationModel
+
+    return TimmClassificationModel(**model)
+
+
+def get_interface_key():
+    # The inputs.json is a system generated file that contains information about
+    # the inputs that interface with the algorithm
+    inputs = load_json_file(
+        location=INPUT_PATH / "inputs.json",
+    )
+    socket_slugs = [sv["interface"]["slug"] for sv in inputs]
+    return tuple(sorted(socket_slugs))
+
+
+def print_stack_layout(stack):
+    # The predictions are written in this frame order
+    print(f"Loaded {len(stack)} frames from {len(stack.files)} file(s)")
+    for file, start, end in zip(stack.files, stack.offsets[:-1], stack.offsets[1:], strict=True):
+        print(f"\tframes {start}-{end - 1}: {Path(file).name}")
+
+
+def show_torch_cuda_info():
+    import torch
+
+    print("=+=" * 10)
+    print("Collecting Torch CUDA information")
+    print(f"Torch CUDA is available: {(available := torch.cuda.is_available())}")
+    if available:
+        print(f"\tnumber of devices: {torch.cuda.device_count()}")
+        print(f"\tcurrent device: { (current_device := torch.cuda.current_device())}")
+        print(f"\tproperties: {torch.cuda.get_device_properties(current_device)}")
+    print("=+=" * 10)
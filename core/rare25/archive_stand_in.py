@@ -0,0 +1,363 @@
+"""
+A local stand-in of the Grand-Challenge archive API, to try rare25.upload.
+
+`StandInArchive` is an HTTPS server with the endpoints that gcapi.Client (0.16)
+calls to upload cases to an archive, `StandInArchive.client()` returns a
+gcapi.Client for it that trusts its self-signed certificate. It can fail
+requests on purpose: the next `fail_first` requests to archive items, and every
+file upload while `fail_uploads` is set.
+
+  GET   gcapi/                                           the supported gcapi versions
+  GET   archives/?slug=<slug>                            the archive
+  GET   components/interfaces/?slug=<slug>               a socket
+  POST  archives/items/                                  creates an item
+  PATCH archives/items/<pk>/                             sets the sockets to uploaded files
+  POST  uploads/                                         starts a file upload
+  PATCH uploads/<pk>/<s3 id>/generate-presigned-urls/    the URLs to PUT the parts to
+  PUT   uploads/<pk>/<s3 id>/parts/<number>/             uploads one part (a presigned URL)
+  PATCH uploads/<pk>/<s3 id>/complete-multipart-upload/  completes the file upload
+  PATCH uploads/<pk>/<s3 id>/abort-multipart-upload/     aborts the file upload
+
+Run `python -m rare25.archive_stand_in` to run upload.main against it: a first
+run of which every file upload fails, a second that retries failed requests
+and resumes the items of the first, and a third that skips everything.
+"""
+
+import collections
+import hashlib
+import json
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.metadata import version
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+ARCHIVE_SLUG = "rare25-stand-in"
+
+
+class StandInArchive(ThreadingHTTPServer):
+    def __init__(self, *, fail_first=0, fail_uploads=False, port=0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.fail_first = fail_first
+        self.fail_uploads = fail_uploads
+        self.lock = threading.Lock()
+        # pk -> {socket: [file name, ...]}
+        self.items = {}
+        # pk -> {"filename", "status", "parts": {number: (size, sha256)}}
+        self.uploads = {}
+        self.requests = collections.Counter()
+
+        # gcapi only accepts https
+        self.certificate_directory = tempfile.TemporaryDirectory(prefix="rare25-stand-in-tls-")
+        certificate, key = _self_signed_certificate(Path(self.certificate_directory.name))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certificate, key)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.client_context = ssl.create_default_context(cafile=certificate)
+
+    @property
+    def url(self):
+        return f"https://127.0.0.1:{self.server_address[1]}/api/v1/"
+
+    def client(self):
+        import gcapi
+
+        return gcapi.Client(token="stand-in", base_url=self.url, verify=self.client_context)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.certificate_directory.cleanup()
+
+
+def _self_signed_certificate(directory):
+    certificate, key = directory / "certificate.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", str(key), "-out", str(certificate),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return str(certificate), str(key)
+
+
+# Socket slug -> (kind, relative path), of the sockets that rare25.upload uploads to
+SOCKETS = {
+    "stacked-barretts-esophagus-endoscopy-images": ("Image", "images/stacked-barretts-esophagus-endoscopy"),
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self, method):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part][2:]  # without api/v1
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        route = _route(method, parts)
+        with server.lock:
+            server.requests[route] += 1
+            fail = route == "upload-create" and server.fail_uploads
+            if route.startswith("item-") and server.fail_first > 0:
+                server.fail_first -= 1
+                fail = True
+            if fail:
+                server.requests["failed"] += 1
+        if fail:
+            # 500 as gcapi retries 502, 503 and 504 itself
+            return self._respond(500, {"detail": "Internal server error (on purpose)"})
+
+        if route == "version":
+            return self._respond(200, {"latest_version": version("gcapi"), "lowest_supported_version": "0.16"})
+
+        if route == "archive":
+            slug = query.get("slug", "")
+            return self._respond(200, _page([{
+                "pk": slug,
+                "title": f"Stand-in archive {slug}",
+                "logo": "",
+                "description": None,
+                "api_url": f"{server.url}archives/{slug}/",
+                "url": f"{server.url}archives/{slug}/",
+            }]))
+
+        if route == "socket":
+            slug = query.get("slug", "")
+            if slug not in SOCKETS:
+                return self._respond(200, _page([]))
+            kind, relative_path = SOCKETS[slug]
+            return self._respond(200, _page([{
+                "title": slug,
+                "description": None,
+                "slug": slug,
+                "kind": kind,
+                "pk": list(SOCKETS).index(slug) + 1,
+                "default_value": None,
+                "super_kind": kind,
+                "relative_path": relative_path,
+                "overlay_segments": None,
+                "look_up_table": None,
+            }]))
+
+        if route == "item-create":
+            pk = uuid.uuid4().hex
+            with server.lock:
+                server.items[pk] = {}
+            return self._respond(201, _archive_item(pk, json.loads(body)["archive"]))
+
+        if route == "item-update":
+            pk = parts[2]
+            if pk not in server.items:
+                return self._respond(404, {"detail": "Not found"})
+            values = {}
+            for value in json.loads(body)["values"]:
+                uploads = [server.uploads.get(api_url.rstrip("/").rsplit("/", 1)[-1]) for api_url in value["user_uploads"]]
+                if not all(upload and upload["status"] == "Completed" for upload in uploads):
+                    return self._respond(400, {"detail": f"Not uploaded: {value['user_uploads']}"})
+                values[value["interface"]] = [upload["filename"] for upload in uploads]
+            with server.lock:
+                server.items[pk] = values
+            return self._respond(200, _archive_item(pk, None))
+
+        if route == "upload-create":
+            pk = uuid.uuid4().hex
+            upload = {"filename": json.loads(body)["filename"], "s3_upload_id": uuid.uuid4().hex, "status": "Initialized", "parts": {}}
+            with server.lock:
+                server.uploads[pk] = upload
+            return self._respond(201, _user_upload(server, pk, upload))
+
+        upload = server.uploads.get(parts[1]) if route.startswith("upload-") else None
+        if upload is None or parts[2] != upload["s3_upload_id"]:
+            return self._respond(404, {"detail": "Not found"})
+
+        if route == "upload-urls":
+            numbers = json.loads(body)["part_numbers"]
+            presigned_urls = {str(n): f"{server.url}uploads/{parts[1]}/{parts[2]}/parts/{n}/" for n in numbers}
+            return self._respond(200, {**_user_upload(server, parts[1], upload), "presigned_urls": presigned_urls})
+
+        if route == "upload-part":
+            digest = hashlib.sha256(body).hexdigest()
+            with server.lock:
+                upload["parts"][int(parts[4])] = (len(body), digest)
+            return self._respond(200, {}, headers={"ETag": f'"{digest}"'})
+
+        if route == "upload-complete":
+            numbers = [part["PartNumber"] for part in json.loads(body)["parts"]]
+            if sorted(numbers) != sorted(upload["parts"]):
+                return self._respond(400, {"detail": f"Parts {numbers} do not match the uploaded parts"})
+            upload["status"] = "Completed"
+            return self._respond(200, _user_upload(server, parts[1], upload))
+
+        if route == "upload-abort":
+            upload["status"] = "Aborted"
+            return self._respond(200, _user_upload(server, parts[1], upload))
+
+        return self._respond(405, {"detail": "Method not allowed"})
+
+    def _respond(self, status, payload, *, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _route(method, parts):
+    # The name of the endpoint that a request is for, requests are counted by it
+    if parts[:2] == ["archives", "items"]:
+        return {("POST", 2): "item-create", ("PATCH", 3): "item-update"}.get((method, len(parts)), "unknown")
+    if parts[:1] == ["uploads"]:
+        if method == "POST" and len(parts) == 1:
+            return "upload-create"
+        if method == "PUT" and len(parts) == 5 and parts[3] == "parts":
+            return "upload-part"
+        actions = {
+            "generate-presigned-urls": "upload-urls",
+            "complete-multipart-upload": "upload-complete",
+            "abort-multipart-upload": "upload-abort",
+        }
+        if method == "PATCH" and len(parts) == 4 and parts[3] in actions:
+            return actions[parts[3]]
+        return "unknown"
+    return {
+        ("GET", ("gcapi",)): "version",
+        ("GET", ("archives",)): "archive",
+        ("GET", ("components", "interfaces")): "socket",
+    }.get((method, tuple(parts)), "unknown")
+
+
+def _page(results):
+    return {"count": len(results), "next": None, "previous": None, "results": results}
+
+
+def _archive_item(pk, archive):
+    return {
+        "pk": pk,
+        "archive": archive,
+        "values": None,
+        "hanging_protocol": None,
+        "optional_hanging_protocols": [],
+        "view_content": {},
+    }
+
+
+def _user_upload(server, pk, upload):
+    return {
+        "pk": pk,
+        "created": "",
+        "filename": upload["filename"],
+        "key": f"uploads/{pk}",
+        "s3_upload_id": upload["s3_upload_id"],
+        "status": upload["status"],
+        "api_url": f"{server.url}uploads/{pk}/",
+    }
+
+
+def create_cases(root, *, num_cases=6, frames=3, frame_bytes=64 * 1024, seed=0):
+    # Cases in the layout of upload.discover_cases, with random frames
+    import random
+
+    rng = random.Random(seed)
+    for case in range(num_cases):
+        socket_dir = Path(root) / "interface_0" / f"case_{case}" / "images" / "stacked-barretts-esophagus-endoscopy"
+        socket_dir.mkdir(parents=True)
+        for frame in range(frames):
+            (socket_dir / f"frame_{frame}.tiff").write_bytes(rng.randbytes(frame_bytes))
+
+
+def try_upload(*, num_cases=6, frames=3, fail_first=3, max_retries=3):
+    """
+    Runs upload.main three times against a stand-in archive
+
+    Returns the run results, raises AssertionError when the upload did not
+    retry, resume or skip as it should. As all fail_first failures may hit the
+    same case, the resumed run only succeeds when fail_first <= max_retries.
+    """
+    from rare25 import upload
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="rare25-stand-in-") as directory:
+        cases_root = Path(directory) / "cases"
+        journal_path = Path(directory) / "journal.sqlite"
+        create_cases(cases_root, num_cases=num_cases, frames=frames)
+
+        archive = StandInArchive().start()
+        settings = upload.MAX_RETRIES, upload.RETRY_BACKOFF_SECONDS
+        upload.MAX_RETRIES, upload.RETRY_BACKOFF_SECONDS = max_retries, 0.01
+        try:
+            with archive.client() as client:
+                for name, fail_uploads, first in (("interrupted", True, 0), ("resumed", False, fail_first), ("repeated", False, 0)):
+                    print(f"--- {name} upload ---")
+                    archive.fail_uploads, archive.fail_first = fail_uploads, first
+                    before = archive.requests.copy()
+                    exit_code = upload.main(
+                        client=client, archive_slug=ARCHIVE_SLUG, cases_root=cases_root, journal_path=journal_path
+                    )
+                    runs.append({
+                        "name": name,
+                        "exit_code": exit_code,
+                        "requests": dict(archive.requests - before),
+                        "items": len(archive.items),
+                        "completed": sum(bool(values) for values in archive.items.values()),
+                    })
+        finally:
+            upload.MAX_RETRIES, upload.RETRY_BACKOFF_SECONDS = settings
+            archive.stop()
+
+    interrupted, resumed, repeated = runs
+    requests = [collections.Counter(run["requests"]) for run in runs]
+    assert all(not r["unknown"] for r in requests), f"Requests to endpoints the stand-in does not serve: {requests}"
+    assert interrupted["exit_code"] == 1 and interrupted["items"] == num_cases and interrupted["completed"] == 0
+    # Every case was retried until it gave up, its item was created once
+    assert requests[0]["item-create"] == num_cases
+    assert requests[0]["upload-create"] == num_cases * (max_retries + 1) * frames
+    # The items of the interrupted run are reused, the failed requests were retried
+    assert resumed["exit_code"] == 0 and requests[1]["item-create"] == 0
+    assert requests[1]["failed"] == fail_first and resumed["completed"] == num_cases
+    # Nothing is uploaded again
+    assert repeated["exit_code"] == 0 and requests[2]["upload-create"] + requests[2]["item-update"] == 0
+    return runs
+
+
+def main():
+    runs = try_upload()
+    for run in runs:
+        print(f"{run['name']}: exit code {run['exit_code']}, requests {run['requests']}, "
+              f"{run['completed']}/{run['items']} archive items completed")
+    print("The upload retried, resumed and skipped as expected")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
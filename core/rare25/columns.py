@@ -0,0 +1,112 @@
+"""
+Out-of-core frame columns, to evaluate more frames than fit in memory.
+
+In the out-of-core mode of the evaluation, every processed job is spilled to an
+.npz in a scratch directory by the worker that processed it, instead of being
+sent back. The main process appends the spilled jobs one by one to a
+`FrameColumns`: one raw file per column, read back as memmaps. Only fixed-width
+columns are stored:
+
+  prediction    float64
+  ground_truth  int8
+  patient       int32, an index into the patient IDs
+  subtype       int16, an index into the lesion subtypes
+
+The string columns are dictionary-encoded: a patient ID or subtype is stored
+once, in memory, however many frames refer to it. Image names are only used to
+stratify by lesion subtype, so only their subtype is kept.
+"""
+
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from rare25.metrics import center_of, stratify, subtype_of
+from rare25.result_cache import COLUMNS as JOB_COLUMNS
+
+COLUMNS = {
+    "prediction": np.float64,
+    "ground_truth": np.int8,
+    "patient": np.int32,
+    "subtype": np.int16,
+}
+
+
+def spill_job(result, *, directory):
+    """
+    Writes the columns of one processed job to the directory
+
+    Returns what is sent back instead of the result: its location and size.
+    """
+    columns = {column: np.asarray(result[column], dtype=dtype) for column, dtype in JOB_COLUMNS.items()}
+    location = Path(directory) / f"{uuid.uuid4().hex}.npz"
+    np.savez(location, **columns)
+    return {"columns": str(location), "frames": len(columns["prediction"]), "cached": result.get("cached", False)}
+
+
+class FrameColumns:
+    def __init__(self, *, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.files = {column: open(self.directory / f"{column}.bin", "wb") for column in COLUMNS}
+        self.patients = {}
+        self.subtypes = {}
+        self.frames = 0
+
+    def append_spilled(self, location):
+        # Appends a job written by spill_job and removes its file
+        with np.load(location) as job:
+            self.append(
+                prediction=job["prediction"],
+                ground_truth=job["ground_truth"],
+                patient_id=job["patient_id"],
+                image_name=job["image_name"],
+            )
+        os.remove(location)
+
+    def append(self, *, prediction, ground_truth, patient_id, image_name):
+        patient = _encode(patient_id, dictionary=self.patients)
+        subtype = _encode([subtype_of(name) for name in image_name], dictionary=self.subtypes)
+
+        for column, values in (
+            ("prediction", prediction),
+            ("ground_truth", ground_truth),
+            ("patient", patient),
+            ("subtype", subtype),
+        ):
+            np.asarray(values, dtype=COLUMNS[column]).tofile(self.files[column])
+        self.frames += len(prediction)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+    def open(self):
+        """
+        Closes the columns for appending and returns them as read-only memmaps
+        """
+        self.close()
+        if not self.frames:
+            raise RuntimeError("No frames were appended")
+        return {
+            column: np.memmap(self.directory / f"{column}.bin", dtype=dtype, mode="r", shape=(self.frames,))
+            for column, dtype in COLUMNS.items()
+        }
+
+    def strata(self, *, columns):
+        # The center and subtype strata of bootstrap_metrics, from the codes
+        center_names, patient_centers = np.unique([center_of(p) for p in self.patients], return_inverse=True)
+        return stratify(
+            y_true=columns["ground_truth"],
+            centers=(patient_centers.astype(np.int16)[columns["patient"]], center_names),
+            subtypes=(columns["subtype"], list(self.subtypes)),
+        )
+
+
+def _encode(values, *, dictionary):
+    # The codes of the values, new values are added to the dictionary
+    unique, inverse = np.unique(np.asarray(values), return_inverse=True)
+    codes = np.array([dictionary.setdefault(str(value), len(dictionary)) for value in unique], dtype=np.int64)
+    return codes[inverse]
@@ -0,0 +1,261 @@
+"""
+A training Dataset over the batch TIFFs of create_tiff_files.py.
+
+`BatchTiffDataset` reads the {split}_batch_*.tiff files and {split}_metadata.json
+of a directory. On construction it walks the page directories (IFDs) of every
+TIFF once, which only reads the headers, and records where the pixels of every
+page are. A frame is then one read at a known offset: its neighbours are never
+decoded, and no page directory is walked again.
+
+The batch TIFFs are written uncompressed, with the pixels of a page in one
+contiguous range. Pages that are not (e.g. compressed ones) are decoded with
+Pillow instead.
+
+The Dataset is map-style, so a DataLoader's sampler shards the indices across
+its workers. Every worker process opens the files it reads itself and keeps
+them open, at most `max_open_files` at once; open files are never pickled.
+
+`FrameShardDataset` reads the pre-decoded shards that create_tiff_files.py
+writes with output_format 'shards': the frames are sliced from a memmap, so
+reading them neither decodes nor copies. The frames of a patient are
+contiguous, `patient_ranges` holds their [start, end) per patient.
+"""
+
+import os
+import re
+import struct
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from rare25.io import load_json_file
+
+# The TIFF tags that locate the pixels of a page
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+
+# struct formats of the TIFF field types that these tags use: BYTE, SHORT and LONG
+_FIELD_TYPES = {1: "B", 3: "H", 4: "I"}
+
+
+def index_tiff_pages(path):
+    """
+    Returns, per page, the offset and size of its pixels and its shape
+
+    Offset and size are None if the pixels cannot be read as they are stored.
+    """
+    pages = []
+    with open(path, "rb") as f:
+        header = f.read(8)
+        byte_order = {b"II": "<", b"MM": ">"}.get(header[:2])
+        if byte_order is None or struct.unpack(byte_order + "H", header[2:4])[0] != 42:
+            raise ValueError(f"{path} is not a (classic) TIFF file")
+        (offset,) = struct.unpack(byte_order + "I", header[4:8])
+
+        while offset:
+            f.seek(offset)
+            (count,) = struct.unpack(byte_order + "H", f.read(2))
+            directory = f.read(12 * count + 4)
+            tags = {}
+            for i in range(count):
+                tag, field_type, n, value = struct.unpack(byte_order + "HHI4s", directory[12 * i:12 * i + 12])
+                if field_type not in _FIELD_TYPES:
+                    continue
+                fmt = byte_order + _FIELD_TYPES[field_type] * n
+                size = struct.calcsize(fmt)
+                if size > 4:
+                    # The values do not fit in the entry, it holds their offset
+                    f.seek(struct.unpack(byte_order + "I", value)[0])
+                    value = f.read(size)
+                tags[tag] = struct.unpack(fmt, value[:size])
+            (offset,) = struct.unpack(byte_order + "I", directory[-4:])
+            pages.append(_locate_pixels(tags))
+
+    return pages
+
+
+def _locate_pixels(tags):
+    height, width = tags[IMAGE_LENGTH][0], tags[IMAGE_WIDTH][0]
+    samples = tags.get(SAMPLES_PER_PIXEL, (1,))[0]
+    strip_offsets, strip_sizes = tags[STRIP_OFFSETS], tags[STRIP_BYTE_COUNTS]
+
+    contiguous = all(
+        start + size == next_start
+        for start, size, next_start in zip(strip_offsets, strip_sizes, strip_offsets[1:])
+    )
+    direct = (
+        tags.get(COMPRESSION, (1,))[0] == 1
+        and all(bits == 8 for bits in tags.get(BITS_PER_SAMPLE, (8,)))
+        and tags.get(PLANAR_CONFIGURATION, (1,))[0] == 1
+        and samples in (1, 3)
+        and contiguous
+        and sum(strip_sizes) == height * width * samples
+    )
+    return {
+        "offset": strip_offsets[0] if direct else None,
+        "size": sum(strip_sizes) if direct else None,
+        "shape": (height, width, samples),
+    }
+
+
+class BatchTiffDataset(torch.utils.data.Dataset):
+    """
+    The frames of one split, in the order of its metadata
+
+    An item is a dict with the image (HWC uint8, or what `transform` makes of
+    it as a PIL Image), the label (0 for NDBE, 1 for neoplasia), the patient ID
+    and the file name of the frame. `labels` and `patient_ids` hold them for
+    all frames, e.g. for patient-level sampling.
+    """
+
+    def __init__(self, *, directory, split, transform=None, max_open_files=16):
+        self.directory = Path(directory)
+        self.transform = transform
+        self.max_open_files = max_open_files
+
+        metadata = load_json_file(location=self.directory / f"{split}_metadata.json")
+        batches = sorted(metadata, key=lambda name: [int(p) if p.isdigit() else p for p in re.split(r"(\d+)", name)])
+
+        self.files = []
+        pages, self.labels, self.patient_ids, self.filenames = [], [], [], []
+        for file_index, batch in enumerate(batches):
+            path = self.directory / batch
+            batch_pages = index_tiff_pages(path)
+            self.files.append(str(path))
+            for frame in metadata[batch]:
+                if frame["index"] >= len(batch_pages):
+                    raise RuntimeError(f"{batch} has {len(batch_pages)} pages, the metadata lists page {frame['index']}")
+                pages.append((file_index, frame["index"], batch_pages[frame["index"]]))
+                self.labels.append(0 if frame["class"] == "ndbe" else 1)
+                self.patient_ids.append(frame["patient_id"])
+                self.filenames.append(frame["filename"])
+
+        self.labels = np.array(self.labels, dtype=np.int8)
+        self.file_index = np.array([file_index for file_index, _, _ in pages], dtype=np.int32)
+        self.page_index = np.array([page for _, page, _ in pages], dtype=np.int32)
+        # -1 where the page is decoded with Pillow
+        self.offsets = np.array([-1 if p["offset"] is None else p["offset"] for _, _, p in pages], dtype=np.int64)
+        self.shapes = [p["shape"] for _, _, p in pages]
+
+        self._handles = _FileHandles(max_open=max_open_files)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        image = self.read(index)
+        if self.transform is not None:
+            image = self.transform(Image.fromarray(image))
+        return {
+            "image": image,
+            "label": int(self.labels[index]),
+            "patient_id": self.patient_ids[index],
+            "filename": self.filenames[index],
+        }
+
+    def read(self, index):
+        # The frame as (height, width, channels) uint8
+        path = self.files[self.file_index[index]]
+        shape = self.shapes[index]
+        if self.offsets[index] < 0:
+            with Image.open(path) as image:
+                image.seek(int(self.page_index[index]))
+                return np.asarray(image.convert("RGB"))
+
+        frame = np.empty(shape, dtype=np.uint8)
+        f = self._handles.get(path)
+        f.seek(int(self.offsets[index]))
+        if f.readinto(memoryview(frame).cast("B")) != frame.nbytes:
+            raise RuntimeError(f"{path} ends within page {self.page_index[index]}")
+        return frame if shape[2] != 1 else np.repeat(frame, 3, axis=2)
+
+    def __getstate__(self):
+        # Open files stay with their process, workers open their own
+        state = self.__dict__.copy()
+        state["_handles"] = _FileHandles(max_open=self.max_open_files)
+        return state
+
+
+class FrameShardDataset(torch.utils.data.Dataset):
+    """
+    The frames of one split, from the shards of create_tiff_files.py
+
+    Items are those of BatchTiffDataset, the image is a view into the memmap
+    unless there is a `transform`. The memmap is copy-on-write: tensors can be
+    made from its views, writing to them never changes the file.
+    """
+
+    def __init__(self, *, directory, split, transform=None):
+        self.directory = Path(directory)
+        self.split = split
+        self.transform = transform
+
+        with np.load(self.directory / f"{split}_table.npz") as table:
+            self.labels = table["label"]
+            self.patient_ids = table["patient_id"]
+            self.filenames = table["filename"]
+        self.patient_ranges = {
+            patient_id: tuple(frame_range)
+            for patient_id, frame_range in load_json_file(location=self.directory / f"{split}_patients.json").items()
+        }
+        self.frames = np.load(self.directory / f"{split}_frames.npy", mmap_mode="c")
+        if len(self.frames) != len(self.labels):
+            raise RuntimeError(f"The {split} shard has {len(self.frames)} frames, its table {len(self.labels)}")
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        image = self.frames[index]
+        if self.transform is not None:
+            image = self.transform(Image.fromarray(image))
+        return {
+            "image": image,
+            "label": int(self.labels[index]),
+            "patient_id": str(self.patient_ids[index]),
+            "filename": str(self.filenames[index]),
+        }
+
+    def __getstate__(self):
+        # Workers map the frames themselves
+        state = self.__dict__.copy()
+        del state["frames"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.frames = np.load(self.directory / f"{self.split}_frames.npy", mmap_mode="c")
+
+
+class _FileHandles:
+    # The open files of one process, the least recently used is closed first
+
+    def __init__(self, *, max_open):
+        self.max_open = max_open
+        self.pid = os.getpid()
+        self.files = OrderedDict()
+
+    def get(self, path):
+        if os.getpid() != self.pid:
+            # A forked worker: the files of the parent are not its to share
+            for f in self.files.values():
+                f.close()
+            self.files.clear()
+            self.pid = os.getpid()
+
+        f = self.files.get(path)
+        if f is None:
+            f = self.files[path] = open(path, "rb", buffering=0)
+            if len(self.files) > self.max_open:
+                self.files.popitem(last=False)[1].close()
+        self.files.move_to_end(path)
+        return f
@@ -0,0 +1,178 @@
+"""
+Content-addressed on-disk cache of backbone features and logits.
+
+Entries are keyed by a hash of the preprocessed frame (and the test-time
+augmented view of it), so repeated or duplicated frames skip the backbone,
+whichever stack or run they come from. Features and logits live in
+memory-mapped .npy files of a fixed capacity, derived from a size cap; when
+the cache is full the least recently used entries are overwritten. The key and
+last use of every slot are memory-mapped next to them. A slot is marked empty
+and flushed before its data is overwritten, and only gets its new key once the
+data is flushed, so the data of a slot is not attributed to the wrong key after
+a crash.
+
+Every model gets its own subdirectory, keyed by its architecture, weights and
+preprocessing, so a cache directory can be shared between models. A cache
+holds a lock on its subdirectory; another cache of the same model, e.g. a
+second ensemble member or process, uses the next free one (<key>-1, <key>-2, ...).
+"""
+
+import atexit
+import fcntl
+import hashlib
+import itertools
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+KEY_BYTES = 16
+
+
+class EmbeddingCache:
+    def __init__(self, directory, *, model_key, feature_dim, num_outputs=1, max_mib=1024):
+        self.directory, self.lock = _lock_directory(Path(directory), model_key=model_key)
+
+        entry_bytes = 4 * (feature_dim + num_outputs)
+        self.capacity = max(1, int(max_mib * 2**20) // entry_bytes)
+        self.hits = 0
+        self.misses = 0
+
+        # Insertion order is the LRU order: least recently used first
+        self.entries = OrderedDict()
+        shapes = {
+            "features": ((self.capacity, feature_dim), np.float32),
+            "logits": ((self.capacity, num_outputs), np.float32),
+            "keys": ((self.capacity, KEY_BYTES), np.uint8),
+            # A use counter per slot, 0 for an empty slot
+            "last_used": ((self.capacity,), np.int64),
+        }
+        reuse = all(self._matches(self.directory / f"{name}.npy", shape) for name, (shape, _) in shapes.items())
+        for name, (shape, dtype) in shapes.items():
+            path = self.directory / f"{name}.npy"
+            if reuse:
+                setattr(self, name, np.lib.format.open_memmap(path, mode="r+"))
+            else:
+                # New, or created with another size cap: start over
+                setattr(self, name, np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape))
+
+        used = np.flatnonzero(self.last_used)
+        # Empty slots, e.g. those a crash left marked empty, are the first to be taken
+        self.free = np.flatnonzero(self.last_used == 0)[::-1].tolist()
+        for slot in used[np.argsort(self.last_used[used])]:
+            key = self.keys[slot].tobytes()
+            if key in self.entries:
+                self.free.append(self.entries[key])
+            self.entries[key] = int(slot)
+        self.clock = int(self.last_used.max(initial=0))
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _matches(path, shape):
+        if not path.is_file():
+            return False
+        return np.load(path, mmap_mode="r").shape == shape
+
+    def _touch(self, slot):
+        self.clock += 1
+        self.last_used[slot] = self.clock
+
+    def get(self, keys):
+        """
+        Looks up a list of keys
+
+        Returns a boolean hit mask and the features and logits of the hits
+        """
+        slots = []
+        hit = np.zeros(len(keys), dtype=bool)
+        for i, key in enumerate(keys):
+            slot = self.entries.get(key)
+            if slot is not None:
+                self.entries.move_to_end(key)
+                self._touch(slot)
+                slots.append(slot)
+                hit[i] = True
+
+        self.hits += len(slots)
+        self.misses += len(keys) - len(slots)
+        return hit, self.features[slots], self.logits[slots]
+
+    def put(self, keys, *, features, logits):
+        slots = []
+        for key in keys:
+            if key in self.entries:
+                slot = self.entries[key]
+                self.entries.move_to_end(key)
+            elif self.free:
+                slot = self.free.pop()
+                self.entries[key] = slot
+            else:
+                # Evict the least recently used entry and take its slot
+                _, slot = self.entries.popitem(last=False)
+                self.entries[key] = slot
+            slots.append(slot)
+
+        # Empty the slots, write their data and only then their keys, flushing in between
+        self.last_used[slots] = 0
+        self.last_used.flush()
+        for slot, key, feature, logit in zip(slots, keys, features, logits, strict=True):
+            self.features[slot] = feature
+            self.logits[slot] = logit
+            self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+        for array in (self.features, self.logits, self.keys):
+            array.flush()
+        for slot in slots:
+            self._touch(slot)
+        self.last_used.flush()
+
+    def flush(self):
+        for array in (self.features, self.logits, self.keys, self.last_used):
+            array.flush()
+
+        if self.hits or self.misses:
+            print(
+                f"Embedding cache {self.directory}: {self.hits} hits, {self.misses} misses, "
+                f"{len(self.entries)}/{self.capacity} entries"
+            )
+            self.hits = self.misses = 0
+
+    def close(self):
+        # Flushes and releases the directory to other caches of the model
+        self.flush()
+        atexit.unregister(self.flush)
+        self.lock.close()
+
+
+def _lock_directory(root, *, model_key):
+    # The first directory of the model that no other cache holds, and its held lock
+    for suffix in itertools.count():
+        directory = root / (model_key if suffix == 0 else f"{model_key}-{suffix}")
+        directory.mkdir(parents=True, exist_ok=True)
+        lock = open(directory / "lock", "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+        return directory, lock
+
+
+def frame_keys(batch):
+    # One content hash per preprocessed frame of a (N, C, H, W) tensor
+    return [hashlib.blake2b(frame.numpy().tobytes(), digest_size=KEY_BYTES).digest() for frame in batch.cpu()]
+
+
+def view_key(frame_key, view_name):
+    return hashlib.blake2b(frame_key + view_name.encode(), digest_size=KEY_BYTES).digest()
+
+
+def model_key(*, model_name, weights, transform):
+    # Features are only valid for the same architecture, weights and preprocessing
+    digest = hashlib.blake2b(digest_size=KEY_BYTES)
+    digest.update(model_name.encode())
+    digest.update(repr(transform).encode())
+    with open(weights, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return f"{model_name}-{digest.hexdigest()}"
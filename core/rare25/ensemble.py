@@ -0,0 +1,134 @@
+"""
+An ensemble of TimmClassificationModels that share one preprocessed stack.
+
+The ensemble is configured by a JSON manifest, typically resources/ensemble.json:
+
+    {
+        "batch_size": 32,
+        "combine": "mean_prob",
+        "threads": "auto",
+        "members": [
+            {"model_name": "resnet50", "weights": "resnet50.pth", "weight": 2.0},
+            {"model_name": "efficientnet_b0", "weights": "effnet_b0.pth", "tta": ["hflip"]}
+        ]
+    }
+
+Member entries hold the keyword arguments of TimmClassificationModel plus an
+optional "weight" (default 1). Relative weight paths are resolved against the
+directory of the manifest. The frames are decoded and preprocessed once per
+batch, every member runs on the same tensors and the member probabilities are
+combined with a weighted mean of the probabilities ("mean_prob") or of the
+logits ("mean_logit").
+
+"threads" runs the members concurrently: true, false or "auto", which only
+does so on a GPU. On the CPU a single forward pass already uses every core,
+so threads there ("threads": true) divide the intra-op threads of torch over
+the members instead of oversubscribing the cores.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+
+from rare25.io import load_json_file
+from rare25.timm_model import TimmClassificationModel
+
+ENSEMBLE_COMBINATIONS = ("mean_prob", "mean_logit")
+
+
+class EnsembleModel:
+    def __init__(self, *, members, weights=None, batch_size=32, combine="mean_prob", threads="auto"):
+        if combine not in ENSEMBLE_COMBINATIONS:
+            raise ValueError(f"Unknown ensemble combination {combine!r}, expected one of {ENSEMBLE_COMBINATIONS}")
+        if not members:
+            raise ValueError("An ensemble needs at least one member")
+
+        weights = [1.0] * len(members) if weights is None else list(weights)
+        if len(weights) != len(members):
+            raise ValueError(f"Expected {len(members)} weights, got {len(weights)}")
+        if sum(weights) <= 0:
+            raise ValueError("The ensemble weights must sum to a positive number")
+
+        self.members = list(members)
+        self.weights = torch.tensor(weights, dtype=torch.float32) / sum(weights)
+        self.batch_size = batch_size
+        self.combine = combine
+        self.threads = use_threads(threads, members=self.members)
+        if self.threads and all(member.device.type == "cpu" for member in self.members):
+            # torch's intra-op threads are shared by the process, split them over the members
+            torch.set_num_threads(max(1, torch.get_num_threads() // len(self.members)))
+        self.executor = ThreadPoolExecutor(max_workers=len(self.members)) if self.threads else None
+
+    @classmethod
+    def from_manifest(cls, location):
+        location = Path(location)
+        manifest = load_json_file(location=location)
+
+        members, weights = [], []
+        for entry in manifest["members"]:
+            entry = dict(entry)
+            weights.append(float(entry.pop("weight", 1.0)))
+            entry["weights"] = location.parent / entry["weights"]
+            if "tta" in entry:
+                entry["tta"] = tuple(entry["tta"])
+            members.append(TimmClassificationModel(**entry))
+
+        return cls(
+            members=members,
+            weights=weights,
+            batch_size=manifest.get("batch_size", 32),
+            combine=manifest.get("combine", "mean_prob"),
+            threads=manifest.get("threads", "auto"),
+        )
+
+    def predict(self, images):
+        # Decode and preprocessing happen once, the first member does it for everyone
+        max_views = max(len(member.tta_views) for member in self.members)
+        batches = self.preprocess_batches(images, images_per_batch=max(1, self.batch_size // max_views))
+
+        print(
+            f"Ensemble of {len(self.members)} models, combined by {self.combine} with weights "
+            f"{[round(w, 3) for w in self.weights.tolist()]}, {'threaded' if self.threads else 'sequential'}"
+        )
+
+        probs = []
+        for batch in batches:
+            probs.extend(self.predict_batch(batch).tolist())
+
+        for member in self.members:
+            if member.cache is not None:
+                member.cache.flush()
+
+        return probs
+
+    def preprocess_batches(self, images, *, images_per_batch):
+        return self.members[0].preprocess_batches(images, images_per_batch=images_per_batch)
+
+    def predict_batch(self, batch):
+        # Only move the shared batch once to the device of the members
+        batch = batch.to(self.members[0].device)
+        if self.threads:
+            member_probs = list(self.executor.map(lambda member: member.predict_batch(batch), self.members))
+        else:
+            member_probs = [member.predict_batch(batch) for member in self.members]
+        return self.combine_probs(torch.stack([p.cpu() for p in member_probs]))
+
+    def combine_probs(self, member_probs):
+        # Combines the probabilities of shape (members, images) into one per image
+        weights = self.weights[:, None]
+        if self.combine == "mean_prob":
+            return (weights * member_probs).sum(dim=0)
+        return torch.sigmoid((weights * torch.logit(member_probs, eps=1e-7)).sum(dim=0))
+
+
+def use_threads(threads, *, members):
+    if threads != "auto":
+        return bool(threads)
+    if len(members) < 2:
+        return False
+    # On the GPU, the kernels of one member can overlap the Python overhead of another
+    if any(member.device.type == "cuda" for member in members):
+        return True
+    # On the CPU, concurrent members would compete for the intra-op threads
+    return False
@@ -0,0 +1,490 @@
+"""
+Runs an evaluation container. Its steps are as follows:
+
+  1. Read the algorithm output
+  2. Associate original algorithm inputs with a ground truths via predictions.json
+  3. Calculate metrics by comparing the algorithm output to the ground truth
+  4. Repeat for all algorithm jobs that ran for this submission
+  5. Aggregate the calculated metrics
+  6. Save the metrics to metrics.json
+"""
+
+import os
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+from pprint import pformat
+
+import numpy as np
+
+from rare25 import INTERFACE_0
+from rare25.io import iter_json_array, load_json_file, write_json_file
+from rare25.processing import run_prediction_processing, tree
+
+# The directories can be overridden to evaluate outside of the container (see rare25.local)
+INPUT_DIRECTORY = Path(os.getenv("RARE25_INPUT_DIRECTORY", "/input"))
+OUTPUT_DIRECTORY = Path(os.getenv("RARE25_OUTPUT_DIRECTORY", "/output"))
+
+# Upload the ground truth as a tarball to Grand Challenge
+# Go to phase settings and upload it under Ground Truths. Your ground truth will be extracted to `GROUND_TRUTH_DIRECTORY` at runtime.
+GROUND_TRUTH_DIRECTORY = Path(os.getenv("RARE25_GROUND_TRUTH_DIRECTORY", "/opt/ml/input/data/ground_truth"))
+
+# Set to profile the evaluation, including the workers, the results go to /output/profile
+# On the platform, profiling can also be turned on by adding an empty `profile`
+# file to the ground truth tarball, which does not require rebuilding the image
+PROFILE = bool(os.getenv("RARE25_PROFILE"))
+PROFILE_FLAG_FILE = "profile"
+
+# Set to a directory to cache processed jobs in, re-evaluating the same outputs
+# against the same ground truth then only recomputes the metrics (see rare25.result_cache)
+RESULT_CACHE_DIRECTORY = os.getenv("RARE25_RESULT_CACHE")
+
+# Set to a directory, e.g. /tmp, to evaluate out of core: processed jobs are spilled
+# there and the metrics run over memory-mapped columns (see rare25.columns)
+OUT_OF_CORE_DIRECTORY = os.getenv("RARE25_OUT_OF_CORE")
+
+# How the confidence intervals are computed: by bootstrapping patients, with
+# clustered DeLong (the AUROC only, quick, see rare25.delong) or both
+CONFIDENCE_INTERVALS = ("bootstrap", "delong", "both")
+
+
+def main(*, ground_truth_file, bootstrap, confidence_intervals="bootstrap"):
+    """
+    Evaluates all algorithm jobs of a submission
+
+    `ground_truth_file` is the metadata file, relative to GROUND_TRUTH_DIRECTORY,
+    that holds the class and patient of every frame of every stack.
+    `bootstrap` holds the keyword arguments of bootstrap_metrics.
+    `confidence_intervals` is one of CONFIDENCE_INTERVALS.
+    """
+    if confidence_intervals not in CONFIDENCE_INTERVALS:
+        raise ValueError(f"confidence_intervals should be one of {CONFIDENCE_INTERVALS}, not {confidence_intervals!r}")
+
+    if PROFILE or (GROUND_TRUTH_DIRECTORY / PROFILE_FLAG_FILE).exists():
+        from rare25.profiling import Profiler
+
+        profiler = Profiler(output_directory=OUTPUT_DIRECTORY / "profile")
+    else:
+        profiler = None
+
+    with profiler.profile() if profiler else nullcontext():
+        return _main(
+            ground_truth_file=ground_truth_file,
+            bootstrap=bootstrap,
+            confidence_intervals=confidence_intervals,
+            profiler=profiler,
+        )
+
+
+def _main(*, ground_truth_file, bootstrap, confidence_intervals, profiler):
+    print_inputs()
+
+    metrics = {}
+    # Parsed incrementally by the processing pool, jobs are processed while it parses
+    predictions = JobStream(
+        location=INPUT_DIRECTORY / "predictions.json",
+        ground_truth_location=GROUND_TRUTH_DIRECTORY / ground_truth_file,
+    )
+
+    # We now process each algorithm job for this submission
+    # Note that the jobs are not in any specific order!
+    # We work that out from predictions.json
+
+    if RESULT_CACHE_DIRECTORY:
+        from rare25.result_cache import ResultCache, file_version
+
+        cache = ResultCache(
+            directory=RESULT_CACHE_DIRECTORY,
+            ground_truth_version=file_version(GROUND_TRUTH_DIRECTORY / ground_truth_file),
+        )
+    else:
+        cache = None
+
+    if OUT_OF_CORE_DIRECTORY:
+        scratch = tempfile.TemporaryDirectory(dir=OUT_OF_CORE_DIRECTORY, prefix="rare25-evaluation-")
+    else:
+        scratch = nullcontext()
+
+    with scratch as scratch_directory:
+        spill_directory = None
+        if scratch_directory:
+            spill_directory = Path(scratch_directory) / "jobs"
+            spill_directory.mkdir()
+
+        # Use concurrent workers to process the predictions more efficiently
+        fn = partial(process, cache=cache, spill_directory=spill_directory)
+        if profiler:
+            fn = profiler.wrap(fn)
+        results = run_prediction_processing(fn=fn, predictions=predictions, profiler=profiler)
+
+        # The outputs were checked while they were processed, report the unusable ones together
+        report_invalid_outputs(results)
+
+        if cache is not None:
+            print(f"Reused {sum(item['cached'] for item in results)}/{len(results)} processed jobs from {cache.directory}")
+
+        if scratch_directory:
+            data, strata = read_spilled_results(
+                results, directory=Path(scratch_directory), stratify=bootstrap.get("stratify", False)
+            )
+        else:
+            data, strata = concatenate_results(results), None
+
+        print("Calculating metrics...")
+        start = time.perf_counter()
+        metrics = calculate_metrics(
+            data=data, strata=strata, bootstrap=bootstrap, confidence_intervals=confidence_intervals
+        )
+        print(f"Calculated the metrics in {time.perf_counter() - start:.2f}s")
+
+    print(metrics)
+
+    # Make sure to save the metrics
+    write_metrics(metrics=metrics)
+
+    return 0
+
+
+def concatenate_results(results):
+    # the results contains a list with directory that contains the ground truths and predictions
+    # now concatenate the results into a single list
+    data = {'ground_truth': [], 'prediction': [], 'patient_id': [], 'image_name': []}
+
+    # calculate the metrics
+    for item in results:
+        data['ground_truth'].append(item['ground_truth'])
+        data['prediction'].append(item['prediction'])
+        data['patient_id'].append(item['patient_id'])
+        data['image_name'].append(item['image_name'])
+
+    flattened_data = {
+        'ground_truth': np.concatenate(data['ground_truth']).tolist(),
+        'prediction': np.concatenate(data['prediction']).tolist(),
+        'patient_id': np.concatenate(data['patient_id']).tolist(),
+        'image_name': np.concatenate(data['image_name']).tolist(),
+    }
+
+    return flattened_data
+
+
+def read_spilled_results(results, *, directory, stratify):
+    """
+    Appends the spilled jobs to memory-mapped columns, returns them and their strata
+
+    The patient IDs are replaced by their codes, which the metrics use as they
+    are, the image names are dropped. The columns are written to the columns
+    subdirectory of the scratch directory, the sorted arrays of the metrics to
+    its curves subdirectory.
+    """
+    from rare25.columns import FrameColumns
+
+    columns = FrameColumns(directory=directory / "columns")
+    for item in results:
+        columns.append_spilled(item["columns"])
+    arrays = columns.open()
+    print(f"Appended {columns.frames} frames of {len(columns.patients)} patients to {columns.directory}")
+
+    data = {
+        'ground_truth': arrays['ground_truth'],
+        'prediction': arrays['prediction'],
+        'patient_id': arrays['patient'],
+        'num_patients': len(columns.patients),
+        'image_name': None,
+        'directory': directory / "curves",
+    }
+    return data, columns.strata(columns=arrays) if stratify else None
+
+
+def calculate_metrics(*, data, bootstrap, confidence_intervals, strata=None):
+    # The DeLong metrics are added to the bootstrapped ones, or replace them
+    metrics = {}
+    if confidence_intervals in ("bootstrap", "both"):
+        from rare25.metrics import bootstrap_metrics
+
+        metrics = bootstrap_metrics(
+            data['ground_truth'],
+            data['prediction'],
+            data['patient_id'],
+            image_names=data['image_name'],
+            strata=strata,
+            num_patients=data.get('num_patients'),
+            directory=data.get('directory'),
+            **bootstrap,
+        )
+
+    if confidence_intervals in ("delong", "both"):
+        from rare25.delong import delong_metrics
+
+        delong = delong_metrics(data['ground_truth'], data['prediction'], data['patient_id'])
+        if metrics:
+            metrics["DeLong"] = delong
+        else:
+            metrics = delong
+
+    return metrics
+
+
+def process(job, *, cache=None, spill_directory=None):
+    # The key is a tuple of the slugs of the input sockets, resolved by compact_job
+    interface_key = job["interface_key"]
+
+    # Lookup the handler for this particular set of sockets (i.e. the interface)
+    handler = {
+        INTERFACE_0: process_interface_0,
+    }[interface_key]
+
+    # Call the handler
+    result = handler(job, cache=cache)
+
+    # Out of core, only the location of the result is sent back
+    if spill_directory is not None and "problems" not in result:
+        from rare25.columns import spill_job
+
+        return spill_job(result, directory=spill_directory)
+
+    return result
+
+
+def process_interface_0(
+    job,
+    *,
+    cache=None,
+):
+    """
+    Processes a single algorithm job, looking at the outputs
+
+    The ground truth of its stack comes with the job, see JobStream. An
+    unusable output is not raised but returned as {"pk", "problems"}, so the
+    problems of all jobs can be reported together.
+    """
+    report = "Processing:\n"
+    report += pformat(job)
+    report += "\n"
+
+    try:
+        # Firstly, find the location of the results
+        location_stacked_neoplastic_lesion_likelihoods = (
+            INPUT_DIRECTORY
+            / job["pk"]
+            / "output"
+            / lookup(job["output_paths"], slug="stacked-neoplastic-lesion-likelihoods", kind="Value")
+        )
+
+        # Secondly, retrieve the input file name to match it with your ground truth
+        image_name_stacked_barretts_esophagus_endoscopy_images = lookup(
+            job["image_names"],
+            slug="stacked-barretts-esophagus-endoscopy-images",
+            kind="Image",
+        )
+    except RuntimeError as e:
+        return {"pk": job["pk"], "problems": [str(e)]}
+
+    try:
+        # The same results against the same ground truth were processed before,
+        # the key hashes the likelihood file, so a missing one is reported below
+        if cache is not None:
+            cache_key = cache.key(
+                likelihoods_location=location_stacked_neoplastic_lesion_likelihoods,
+                image_name=image_name_stacked_barretts_esophagus_endoscopy_images,
+            )
+            if (cached := cache.get(cache_key)) is not None:
+                return {**cached, "cached": True}
+
+        # Thirdly, read the results
+        result_stacked_neoplastic_lesion_likelihoods = load_json_file(
+            location=location_stacked_neoplastic_lesion_likelihoods,
+        )
+    except FileNotFoundError:
+        return {"pk": job["pk"], "problems": [f"{location_stacked_neoplastic_lesion_likelihoods} does not exist"]}
+    except ValueError as e:  # Both json and orjson decode errors are ValueErrors
+        return {
+            "pk": job["pk"],
+            "problems": [f"{location_stacked_neoplastic_lesion_likelihoods} is not valid json: {e}"],
+        }
+
+    # Now we can match the image name with the ground truth
+    gt_data = job["ground_truth"]
+    if gt_data is None:
+        return {
+            "pk": job["pk"],
+            "problems": [
+                f"Image name {image_name_stacked_barretts_esophagus_endoscopy_images} not found in the ground truth metadata"
+            ],
+        }
+
+    problems = check_likelihoods(
+        result_stacked_neoplastic_lesion_likelihoods,
+        location=location_stacked_neoplastic_lesion_likelihoods,
+        image_name=image_name_stacked_barretts_esophagus_endoscopy_images,
+        num_frames=len(gt_data),
+    )
+    if problems:
+        return {"pk": job["pk"], "problems": problems}
+
+    ground_truth = []
+    patient_id = []
+    image_name = []
+
+    # match idx predictions to idx ground truth
+    for idx in range(0, len(result_stacked_neoplastic_lesion_likelihoods)):
+        label = gt_data[idx]["class"]
+        if label == "ndbe":
+            ground_truth.append(0)
+        else:
+            ground_truth.append(1)
+        patient_id.append(gt_data[idx]["patient_id"])
+        image_name.append(gt_data[idx]["filename"])
+
+    result = {
+        "ground_truth": ground_truth,
+        "prediction": result_stacked_neoplastic_lesion_likelihoods,
+        "patient_id": patient_id,
+        "image_name": image_name,
+    }
+    if cache is not None:
+        cache.put(cache_key, result)
+
+    return {**result, "cached": False}
+
+
+class PredictionValidationError(Exception):
+    pass
+
+
+def check_likelihoods(likelihoods, *, location, image_name, num_frames):
+    # Returns the problems of the likelihoods of one job, an empty list if they are valid
+    if not isinstance(likelihoods, list):
+        return [f"{location} holds a {type(likelihoods).__name__}, not a list of likelihoods"]
+
+    problems = []
+    if len(likelihoods) != num_frames:
+        problems.append(f"{len(likelihoods)} likelihoods for the {num_frames} frames of {image_name}")
+
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in likelihoods):
+        problems.append("Not all likelihoods are numbers")
+    else:
+        values = np.asarray(likelihoods, dtype=np.float64)
+        if not np.isfinite(values).all():
+            problems.append(f"{np.count_nonzero(~np.isfinite(values))} likelihoods are not finite")
+        elif ((values < 0) | (values > 1)).any():
+            problems.append(f"{np.count_nonzero((values < 0) | (values > 1))} likelihoods are outside of [0, 1]")
+
+    return problems
+
+
+def report_invalid_outputs(results):
+    """
+    Raises PredictionValidationError if the output of any job is invalid
+
+    Every likelihood file must exist, parse, hold exactly one likelihood per
+    frame of its stack in the ground truth and only finite likelihoods in
+    [0, 1]. The jobs are checked as they are processed, so their files are
+    read once; all problems are reported together.
+    """
+    failed = {item["pk"]: item["problems"] for item in results if "problems" in item}
+    if failed:
+        report = f"The outputs of {len(failed)}/{len(results)} jobs are invalid:\n"
+        for pk, job_problems in sorted(failed.items()):
+            report += f"\t{pk}:\n"
+            for problem in job_problems:
+                report += f"\t\t{problem}\n"
+        print(report, file=sys.stderr)
+        raise PredictionValidationError()
+
+
+def print_inputs():
+    # Just for convenience, in the logs you can then see what files you have to work with
+    print("Input Files:")
+    for line in tree(INPUT_DIRECTORY):
+        print(line)
+    print("")
+
+
+class JobStream:
+    """
+    The jobs of a predictions.json as compact records, parsed one at a time
+
+    Only holds the locations, so it is cheap to pickle and the process that
+    iterates it does the parsing. That process loads the ground truth metadata
+    once and adds the frames of its stack to every job, as "ground_truth",
+    or None if the stack is not in it: the workers never load the metadata.
+    """
+
+    def __init__(self, *, location, ground_truth_location):
+        self.location = location
+        self.ground_truth_location = ground_truth_location
+
+    def __iter__(self):
+        metadata = load_json_file(location=self.ground_truth_location)
+        for job in iter_json_array(location=self.location):
+            job = compact_job(job)
+            job["ground_truth"] = metadata.get(job["image_names"].get("stacked-barretts-esophagus-endoscopy-images"))
+            yield job
+
+
+def compact_job(job):
+    """
+    Keeps only what processing a job needs, with the slug lookups resolved once
+
+    The record holds the pk, the interface key, and slug -> image name and
+    slug -> relative path maps of the inputs and outputs.
+    """
+    return {
+        "pk": job["pk"],
+        "interface_key": get_interface_key(job),
+        "image_names": {
+            value["interface"]["slug"]: value["image"]["name"] for value in job["inputs"] if value["image"]
+        },
+        "output_paths": {value["interface"]["slug"]: value["interface"]["relative_path"] for value in job["outputs"]},
+    }
+
+
+def lookup(mapping, *, slug, kind):
+    # A slug of a compact job record
+    try:
+        return mapping[slug]
+    except KeyError:
+        raise RuntimeError(f"{kind} with interface {slug} not found!") from None
+
+
+def read_predictions():
+    # The prediction file tells us the location of the users' predictions
+    return load_json_file(location=INPUT_DIRECTORY / "predictions.json")
+
+
+def get_interface_key(job):
+    # Each interface has a unique key that is the set of socket slugs given as input
+    socket_slugs = [sv["interface"]["slug"] for sv in job["inputs"]]
+    return tuple(sorted(socket_slugs))
+
+
+def get_image_name(*, values, slug):
+    # This tells us the user-provided name of the input or output image
+    for value in values:
+        if value["interface"]["slug"] == slug:
+            return value["image"]["name"]
+
+    raise RuntimeError(f"Image with interface {slug} not found!")
+
+
+def get_interface_relative_path(*, values, slug):
+    # Gets the location of the interface relative to the input or output
+    for value in values:
+        if value["interface"]["slug"] == slug:
+            return value["interface"]["relative_path"]
+
+    raise RuntimeError(f"Value with interface {slug} not found!")
+
+
+def get_file_location(*, job_pk, values, slug):
+    # Where a job's output file will be located in the evaluation container
+    relative_path = get_interface_relative_path(values=values, slug=slug)
+    return INPUT_DIRECTORY / job_pk / "output" / relative_path
+
+
+def write_metrics(*, metrics):
+    # Write a json document used for ranking results on the leaderboard
+    write_json_file(location=OUTPUT_DIRECTORY / "metrics.json", content=metrics)
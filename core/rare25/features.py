@@ -0,0 +1,198 @@
+"""
+Feature extraction: run the backbone once, iterate on the head for free.
+
+`extract_features` runs the timm backbone of a TimmClassificationModel over
+TIFF/MHA stacks (those of the ground truth, in `main`) and writes the pooled features to a
+memory-mapped features.npy, with an index.json that records which rows belong
+to which stack. A `FeatureStore` reads them back; heads then only need
+`TimmClassificationModel.predict_features` or plain numpy.
+
+`calibrate` fits Platt scaling, sigmoid(a * logit + b), of the head logits
+against the labels in a ground truth metadata file such as val_metadata.json.
+"""
+
+import time
+from pathlib import Path
+
+import numpy as np
+
+from rare25.instrumentation import timings
+from rare25.io import count_frames, find_split_stacks, load_json_file, read_frames, write_json_file
+
+
+def main(*, model, stacks_directory, features_directory, ground_truth_file, batch_size=64):
+    from rare25.embedding_cache import model_key
+    from rare25.timm_model import TimmClassificationModel
+
+    # Only the stacks of the ground truth, the directory may hold those of other splits as well
+    metadata = load_json_file(location=ground_truth_file)
+    files = find_split_stacks(location=stacks_directory, names=metadata)
+
+    classifier = TimmClassificationModel(**model)
+    key = model_key(model_name=model["model_name"], weights=model["weights"], transform=classifier.transform)
+
+    # Features are only extracted again when the model or the stacks changed
+    store = FeatureStore.open(features_directory)
+    stack_names = [Path(f).name for f in files]
+    if store is None or store.model_key != key or store.names != stack_names:
+        extract_features(
+            model=classifier,
+            model_key=key,
+            files=files,
+            features_directory=features_directory,
+            batch_size=batch_size,
+        )
+        store = FeatureStore.open(features_directory)
+    else:
+        print(f"Reusing the features of {len(store)} frames in {features_directory}")
+
+    start = time.perf_counter()
+    logits = classifier.predict_features(store.features)
+    print(f"Head-only prediction of {len(store)} frames took {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    calibration = calibrate(store=store, logits=logits, metadata=metadata)
+    write_json_file(location=Path(features_directory) / "calibration.json", content=calibration)
+    print(f"Calibration: {calibration}")
+
+    timings.report()
+    return 0
+
+
+def extract_features(*, model, model_key, files, features_directory, batch_size=64):
+    features_directory = Path(features_directory)
+    features_directory.mkdir(parents=True, exist_ok=True)
+
+    # The headers tell how many rows to allocate
+    offsets = np.concatenate([[0], np.cumsum([count_frames(f) for f in files])]).tolist()
+
+    # The index is written last and marks the features as complete, an interrupted
+    # extraction must not leave the index of the previous one next to its rows
+    (features_directory / "index.json").unlink(missing_ok=True)
+
+    features = np.lib.format.open_memmap(
+        features_directory / "features.npy",
+        mode="w+",
+        dtype=np.float32,
+        shape=(offsets[-1], model.model.num_features),
+    )
+
+    # One stack at a time, so memory does not grow with the dataset
+    for file, start, end in zip(files, offsets[:-1], offsets[1:], strict=True):
+        with timings.stage("image load"):
+            frames = read_frames(file)
+        row = start
+        for batch in model.preprocess_batches(frames, images_per_batch=batch_size):
+            with timings.stage("forward"):
+                batch_features = model.features(batch).cpu().numpy()
+            features[row:row + len(batch_features)] = batch_features
+            row += len(batch_features)
+        if row != end:
+            raise RuntimeError(f"{file} has {row - start} frames, its header says {end - start}")
+        print(f"Extracted the features of {end - start} frames of {Path(file).name}")
+
+    features.flush()
+    write_json_file(
+        location=features_directory / "index.json",
+        content={
+            "model_key": model_key,
+            "stacks": [
+                {"name": Path(file).name, "start": start, "end": end}
+                for file, start, end in zip(files, offsets[:-1], offsets[1:], strict=True)
+            ],
+        },
+    )
+
+
+class FeatureStore:
+    """
+    The pooled features written by extract_features
+
+    features is a read-only (frames, num_features) memmap, store["name.tiff"]
+    returns the rows of one stack.
+    """
+
+    def __init__(self, *, features, index):
+        self.features = features
+        self.model_key = index["model_key"]
+        self.stacks = {stack["name"]: (stack["start"], stack["end"]) for stack in index["stacks"]}
+        self.names = list(self.stacks)
+
+    @classmethod
+    def open(cls, directory):
+        # Returns None if nothing was extracted to the directory yet
+        directory = Path(directory)
+        if not (directory / "index.json").is_file() or not (directory / "features.npy").is_file():
+            return None
+        return cls(
+            features=np.load(directory / "features.npy", mmap_mode="r"),
+            index=load_json_file(location=directory / "index.json"),
+        )
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, name):
+        start, end = self.stacks[name]
+        return self.features[start:end]
+
+    def rows(self, name):
+        start, end = self.stacks[name]
+        return slice(start, end)
+
+
+def calibrate(*, store, logits, metadata, iterations=50):
+    """
+    Fits Platt scaling of the logits against the labels of the metadata
+
+    Only stacks that are in both the store and the metadata are used. Returns
+    the slope and intercept with the log loss and Brier score before and after.
+    """
+    selected_logits, labels = [], []
+    for name in store.names:
+        if name not in metadata:
+            continue
+        frames = metadata[name]
+        rows = store.rows(name)
+        if rows.stop - rows.start != len(frames):
+            raise RuntimeError(f"{name} has {rows.stop - rows.start} frames, the metadata lists {len(frames)}")
+        selected_logits.append(logits[rows])
+        labels.append([0 if frame["class"] == "ndbe" else 1 for frame in frames])
+
+    if not labels:
+        raise RuntimeError("None of the extracted stacks is in the ground truth metadata")
+
+    x = np.concatenate(selected_logits).astype(np.float64)
+    y = np.concatenate(labels).astype(np.float64)
+
+    # Newton's method on the two parameters of the logistic regression
+    a, b = 1.0, 0.0
+    for _ in range(iterations):
+        p = _sigmoid(a * x + b)
+        w = p * (1 - p) + 1e-12
+        gradient = np.array([np.sum((p - y) * x), np.sum(p - y)])
+        hessian = np.array([[np.sum(w * x * x), np.sum(w * x)], [np.sum(w * x), np.sum(w)]])
+        step = np.linalg.solve(hessian + 1e-9 * np.eye(2), gradient)
+        a, b = a - step[0], b - step[1]
+        if np.abs(step).max() < 1e-8:
+            break
+
+    before, after = _sigmoid(x), _sigmoid(a * x + b)
+    return {
+        "frames": len(y),
+        "positives": int(y.sum()),
+        "slope": float(a),
+        "intercept": float(b),
+        "log_loss_before": _log_loss(y, before),
+        "log_loss_after": _log_loss(y, after),
+        "brier_before": float(np.mean((before - y) ** 2)),
+        "brier_after": float(np.mean((after - y) ** 2)),
+    }
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _log_loss(y, p, eps=1e-7):
+    p = np.clip(p, eps, 1 - eps)
+    return float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)))
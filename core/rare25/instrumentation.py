@@ -0,0 +1,117 @@
+"""
+Lightweight per-stage timing and resource instrumentation.
+
+Wrap a stage with `timings.stage("name")` or decorate a function with
+`timings.timed("name")`. Repeated stages (e.g. a forward pass per batch) are
+accumulated. Next to wall time, the peak resident memory of the process and,
+when torch is in use, the peak CUDA memory are tracked.
+
+Set RARE25_WRITE_TIMINGS to profile: code can then measure more than it needs
+(e.g. the forward time of a model without TTA), see `timings.profile`, and
+every stage waits for the GPU so its asynchronous CUDA work lands in the stage
+that launched it. That wait stalls every thread that uses the GPU, such as the
+batching thread of rare25.worker behind its loader threads, so without
+profiling the GPU time of a stage is counted by the stage that waits for it.
+"""
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from rare25.io import write_json_file
+
+
+class Timings:
+    def __init__(self, *, profile=False):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.profile = profile
+        # Stages are recorded by several threads, e.g. the loaders of rare25.worker
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.profile:
+                _synchronize_cuda()
+            elapsed = time.perf_counter() - start
+
+            with self.lock:
+                stage = self.stages.setdefault(name, {"count": 0, "seconds": 0.0, "peak_rss_mib": 0.0})
+                stage["count"] += 1
+                stage["seconds"] += elapsed
+                stage["peak_rss_mib"] = max(stage["peak_rss_mib"], peak_rss_mib())
+
+    def timed(self, name):
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def summary(self):
+        return {
+            "total_seconds": time.perf_counter() - self.start,
+            "peak_rss_mib": peak_rss_mib(),
+            "peak_cuda_mib": peak_cuda_mib(),
+            "stages": self.stages,
+        }
+
+    def report(self):
+        summary = self.summary()
+
+        print("=+=" * 10)
+        print("Timings")
+        for name, stage in summary["stages"].items():
+            print(
+                f"\t{name:<24} {stage['seconds']:9.3f}s"
+                f" ({stage['count']}x, peak RSS {stage['peak_rss_mib']:.0f} MiB)"
+            )
+        print(f"\t{'total':<24} {summary['total_seconds']:9.3f}s")
+        print(f"Peak RSS: {summary['peak_rss_mib']:.0f} MiB")
+        if summary["peak_cuda_mib"] is not None:
+            print(f"Peak CUDA memory: {summary['peak_cuda_mib']:.0f} MiB")
+        print("=+=" * 10)
+
+    def write(self, *, location):
+        write_json_file(location=location, content=self.summary())
+
+
+def peak_rss_mib():
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return 0.0
+
+    # Linux reports kilobytes, macOS bytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def peak_cuda_mib():
+    # Only look at CUDA if something else already imported torch
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return None
+    return torch.cuda.max_memory_allocated() / 2**20
+
+
+def _synchronize_cuda():
+    # Kernels run asynchronously, wait for them so their time lands in the right stage
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        torch.cuda.synchronize()
+
+
+# The timings of this process
+timings = Timings(profile=bool(os.getenv("RARE25_WRITE_TIMINGS")))
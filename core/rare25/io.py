@@ -0,0 +1,294 @@
+"""
+Reading and writing the inputs and outputs.
+
+JSON goes through orjson when it is installed and through the standard library
+otherwise. NumPy arrays and scalars can be written directly, floats can be
+rounded to a fixed precision and files are written atomically: to a temporary
+file next to the target that is then renamed over it, so a reader never sees
+a partially written file. Large arrays can be read one element at a time
+with `iter_json_array`.
+"""
+
+import json
+import os
+import re
+import uuid
+from bisect import bisect_right
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:  # The standard library is the fallback
+    orjson = None
+
+IMAGE_SUFFIXES = (".tif", ".tiff", ".mha")
+
+# Whitespace and the commas between array elements
+_JSON_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def load_json_file(*, location):
+    # Reads a json file
+    with open(location, "rb") as f:
+        content = f.read()
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def write_json_file(*, location, content, indent=4, precision=None):
+    """
+    Writes a json file, atomically
+
+    `indent` is the number of spaces to indent with, None writes compact json.
+    orjson only indents with 2 spaces, other indents use the standard library.
+    `precision` rounds every float to that many decimals.
+    """
+    if precision is not None:
+        content = _round_floats(content, precision)
+
+    data = None
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            data = orjson.dumps(content, option=option)
+        except TypeError:  # E.g. non-string keys, which the standard library converts
+            pass
+    if data is None:
+        data = json.dumps(content, indent=indent, default=_json_default).encode()
+
+    _write_atomically(location, data)
+
+
+def iter_json_array(*, location, chunk_size=1 << 20):
+    """
+    Yields the elements of the top-level array of a json file one at a time
+
+    Only the element being parsed is held in memory, not the whole document.
+    Uses ijson when it is installed.
+    """
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+    if ijson is not None:
+        with open(location, "rb") as f:
+            yield from ijson.items(f, "item", use_float=True)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(location, "r", encoding="utf-8") as f:
+        buffer, position, eof = "", 0, False
+
+        def read_more():
+            nonlocal buffer, position, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+
+        read_more()
+        position = _JSON_SEPARATORS.match(buffer, position).end()
+        if not buffer.startswith("[", position):
+            raise ValueError(f"{location} does not hold a json array")
+        position += 1
+
+        while True:
+            position = _JSON_SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                if eof:
+                    raise ValueError(f"{location} ends before its array does")
+                read_more()
+                continue
+            if buffer[position] == "]":
+                return
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more()  # The element continues in the next chunk
+                continue
+            if end == len(buffer) and not eof:
+                read_more()  # A number could continue in the next chunk
+                continue
+
+            yield element
+            position = end
+
+
+def _write_atomically(location, data):
+    location = Path(location)
+    tmp_path = location.with_name(f".{location.name}.{uuid.uuid4().hex}.tmp")
+    # Unlike mkstemp, this creates the file with the permissions the umask allows
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, location)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _json_default(value):
+    # NumPy arrays and scalars for the standard library encoder
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _round_floats(content, precision):
+    if isinstance(content, float):
+        return round(content, precision)
+    if isinstance(content, dict):
+        return {key: _round_floats(value, precision) for key, value in content.items()}
+    if isinstance(content, (list, tuple)):
+        return [_round_floats(value, precision) for value in content]
+    if hasattr(content, "dtype") and content.dtype.kind == "f":
+        import numpy as np
+
+        # As float64, float32 values would not print as their rounded decimals
+        rounded = np.round(np.asarray(content, dtype=np.float64), precision)
+        return rounded if rounded.ndim else float(rounded)
+    return content
+
+
+def load_image_file_as_array(*, location):
+    # Reads all image files as one array of frames, in file order
+    stack = load_image_stack(location=location)
+    return stack.as_array()
+
+
+def load_image_stack(*, location):
+    """
+    Reads all image files at a location as one logical sequence of frames
+
+    Files are discovered with a single scan, decoded concurrently and kept in
+    (natural) file name order. The returned FrameStack records at which frame
+    each file starts, so per-frame predictions can be mapped back to files.
+    """
+    input_files = find_image_files(location=location)
+    if not input_files:
+        raise FileNotFoundError(f"No {', '.join(IMAGE_SUFFIXES)} files found in {location}")
+
+    if len(input_files) == 1:
+        arrays = [read_frames(input_files[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(input_files), os.cpu_count() or 1)) as executor:
+            arrays = list(executor.map(read_frames, input_files))
+
+    return FrameStack(files=input_files, arrays=arrays)
+
+
+def find_image_files(*, location):
+    with os.scandir(location) as it:
+        files = [
+            entry.path
+            for entry in it
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_SUFFIXES)
+        ]
+    return sorted(files, key=_natural_key)
+
+
+def find_split_stacks(*, location, names):
+    """
+    The stacks of one split in a directory, by the file names of its metadata
+
+    Used to pick e.g. the val_batch_*.tiff files out of the tiff_output_dir of
+    data-processing/create_tiff_files.py, which also holds those of the other
+    split. A directory that is not set, or holds none of the stacks, is an error.
+    """
+    if location is None:
+        raise ValueError(
+            "No stacks directory is set, set it to the tiff_output_dir of data-processing/create_tiff_files.py"
+        )
+    if not os.path.isdir(location):
+        raise FileNotFoundError(f"The stacks directory {location} does not exist")
+
+    files = [file for file in find_image_files(location=location) if os.path.basename(file) in names]
+    if not files:
+        raise FileNotFoundError(
+            f"None of the {len(names)} stacks of the ground truth (e.g. {next(iter(names), None)}) are in {location}"
+        )
+    return files
+
+
+def _natural_key(path):
+    # batch_2 before batch_10
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", os.path.basename(path))]
+
+
+def read_frames(path):
+    import SimpleITK
+
+    # Use SimpleITK to read a file, as (frames, height, width[, channels])
+    image = SimpleITK.ReadImage(path)
+
+    # Convert it to a Numpy array
+    array = SimpleITK.GetArrayFromImage(image)
+
+    if image.GetDimension() == 2:
+        # A single frame, give it a frame axis
+        array = array[None, ...]
+
+    return array
+
+
+def count_frames(path):
+    import SimpleITK
+
+    # Only reads the header
+    reader = SimpleITK.ImageFileReader()
+    reader.SetFileName(str(path))
+    reader.ReadImageInformation()
+    if reader.GetDimension() == 2:
+        return 1
+    return reader.GetSize()[2]
+
+
+class FrameStack(Sequence):
+    """
+    The frames of one or more image files as a single sequence
+
+    offsets[i] is the index of the first frame of files[i], offsets[-1] is the
+    total number of frames. Frames are not copied into one array unless
+    as_array() is called.
+    """
+
+    def __init__(self, *, files, arrays):
+        self.files = list(files)
+        self.arrays = list(arrays)
+        self.offsets = [0]
+        for array in self.arrays:
+            self.offsets.append(self.offsets[-1] + len(array))
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        file_index, frame_index = self.locate(index)
+        return self.arrays[file_index][frame_index]
+
+    def locate(self, index):
+        # Returns the file index and the frame index within that file
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame {index} is out of range for a stack of {len(self)} frames")
+
+        file_index = bisect_right(self.offsets, index) - 1
+        return file_index, index - self.offsets[file_index]
+
+    def as_array(self):
+        import numpy as np
+
+        if len(self.arrays) == 1:
+            return self.arrays[0]
+        return np.concatenate(self.arrays)
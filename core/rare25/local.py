@@ -0,0 +1,160 @@
+"""
+Evaluates a model end to end, in-process and without Docker.
+
+Runs the algorithm on every batch TIFF of the ground truth in a directory with
+one model that is loaded once, lays out the outputs as the evaluation container would receive
+them (a job folder per stack and predictions.json, as
+data-processing/create_random_probabilities.py does) and then calls the
+evaluation on them. The timings of every stage, inference and evaluation, are
+reported at the end.
+
+The work directory ends up holding:
+
+  input/predictions.json
+  input/<stack name>/output/stacked-neoplastic-lesion-likelihoods.json
+  output/metrics.json
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from rare25 import algorithm
+from rare25.instrumentation import timings
+from rare25.io import FrameStack, find_split_stacks, load_json_file, read_frames, write_json_file
+
+
+def main(
+    *,
+    model,
+    stacks_directory,
+    ground_truth_directory,
+    ground_truth_file,
+    work_directory,
+    evaluate,
+    ensemble_manifest=None,
+):
+    """
+    `model` and `ensemble_manifest` are those of the algorithm's inference.py,
+    `evaluate` is the main() of the evaluation's evaluate.py and
+    `ground_truth_file` its ground truth file, relative to `ground_truth_directory`.
+    Only the stacks in `stacks_directory` that the ground truth lists are run.
+    """
+    work_directory = Path(work_directory).resolve()
+    input_directory = work_directory / "input"
+    output_directory = work_directory / "output"
+
+    metadata = load_json_file(location=Path(ground_truth_directory) / ground_truth_file)
+    files = find_split_stacks(location=stacks_directory, names=metadata)
+    output_directory.mkdir(parents=True, exist_ok=True)
+
+    algorithm.show_torch_cuda_info()
+    classifier = algorithm.build_classifier(model=model, ensemble_manifest=ensemble_manifest)
+
+    predictions = []
+    for file in files:
+        start = time.perf_counter()
+        name = Path(file).name
+        pk = Path(file).stem
+
+        with timings.stage("image load"):
+            stack = FrameStack(files=[file], arrays=[read_frames(file)])
+
+        job_output_directory = input_directory / pk / "output"
+        job_output_directory.mkdir(parents=True, exist_ok=True)
+        likelihoods = algorithm.predict_stack(classifier=classifier, stack=stack, output_path=job_output_directory)
+
+        predictions.append(prediction_entry(pk=pk, image_name=name, likelihoods=likelihoods))
+        print(f"Predicted {len(stack)} frames of {name} in {time.perf_counter() - start:.2f}s")
+
+    with timings.stage("predictions.json write"):
+        write_json_file(location=input_directory / "predictions.json", content=predictions, indent=None)
+
+    with timings.stage("evaluation"), _evaluation_directories(
+        input_directory=input_directory,
+        output_directory=output_directory,
+        ground_truth_directory=Path(ground_truth_directory).resolve(),
+    ):
+        result = evaluate()
+
+    timings.report()
+    timings.write(location=output_directory / "timings.json")
+    print(f"Wrote the metrics to {output_directory / 'metrics.json'}")
+
+    return result
+
+
+def prediction_entry(*, pk, image_name, likelihoods):
+    # A job as listed in predictions.json, the output is read from the job folder
+    return {
+        "pk": pk,
+        "inputs": [
+            {
+                "file": None,
+                "image": {"name": image_name},
+                "value": None,
+                "interface": {
+                    "slug": "stacked-barretts-esophagus-endoscopy-images",
+                    "kind": "Image",
+                    "super_kind": "Image",
+                    "relative_path": "images/stacked-barretts-esophagus-endoscopy",
+                    "example_value": None,
+                },
+            }
+        ],
+        "outputs": [
+            {
+                "file": "https://grand-challenge.org/media/some-link/stacked-neoplastic-lesion-likelihoods.json",
+                "image": None,
+                "value": None,
+                "interface": {
+                    "slug": "stacked-neoplastic-lesion-likelihoods",
+                    "kind": "Anything",
+                    "super_kind": "File",
+                    "relative_path": "stacked-neoplastic-lesion-likelihoods.json",
+                    "example_value": likelihoods,
+                },
+            }
+        ],
+        "status": "Succeeded",
+        "started_at": None,
+        "completed_at": None,
+    }
+
+
+# The module attributes of rare25.evaluation and the environment variables that set them
+EVALUATION_DIRECTORIES = {
+    "INPUT_DIRECTORY": "RARE25_INPUT_DIRECTORY",
+    "OUTPUT_DIRECTORY": "RARE25_OUTPUT_DIRECTORY",
+    "GROUND_TRUTH_DIRECTORY": "RARE25_GROUND_TRUTH_DIRECTORY",
+}
+
+
+@contextmanager
+def _evaluation_directories(**directories):
+    """
+    Points the evaluation at the work directory for the duration of the block
+
+    The environment is set as well, so workers of the evaluation that import
+    rare25.evaluation anew (the spawn start method) see the same directories.
+    """
+    from rare25 import evaluation
+
+    saved = {}
+    for name, directory in directories.items():
+        attribute = name.upper()
+        variable = EVALUATION_DIRECTORIES[attribute]
+        saved[attribute] = (getattr(evaluation, attribute), os.environ.get(variable))
+        setattr(evaluation, attribute, Path(directory))
+        os.environ[variable] = str(directory)
+
+    try:
+        yield
+    finally:
+        for attribute, (value, environment_value) in saved.items():
+            setattr(evaluation, attribute, value)
+            if environment_value is None:
+                os.environ.pop(EVALUATION_DIRECTORIES[attribute], None)
+            else:
+                os.environ[EVALUATION_DIRECTORIES[attribute]] = environment_value
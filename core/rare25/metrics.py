@@ -0,0 +1,531 @@
+"""
+The leaderboard metrics: AUROC, AUPRC and PPV at 90% recall, with patient-level
+bootstrapped confidence intervals.
+
+The bootstrap is vectorized. The frames are sorted by prediction once; a
+bootstrap sample is then the sorted positions of the frames of the drawn
+patients, weighted by how often the patient was drawn, so the confusion counts
+at every threshold of a whole block of samples are a single cumulative sum.
+Only drawn frames take part, so a sample costs as much as its frames, however
+large the dataset. The metrics are identical to those of scikit-learn on the
+resampled frames.
+
+Strata (e.g. a center or a lesion subtype) reuse the same draws and the same
+sort: their counts are the cumulative sums of the drawn frames in the stratum.
+The metrics on the full dataset are those of a single sample of every frame,
+computed a chunk of frames at a time.
+
+Memory-mapped inputs are not copied as a whole. The sort is a few arrays of one
+entry per frame (the sort order, the sorted labels and tie groups, the sorted
+positions per patient, and a mask per stratum), held in memory by default. With
+a `directory`, they are memmaps in it instead: the frames are sorted a chunk at
+a time and the sorted chunks are merged, so only a few chunks are in memory at
+once. Patient IDs that are already dictionary-encoded (0 ... num_patients - 1,
+as in rare25.columns) are used as they are.
+
+With a `tolerance`, the bootstrap is adaptive: samples are drawn in blocks
+until the Monte-Carlo standard errors of the medians and 95% CI bounds are
+below the tolerance, between `min_iterations` and `max_iterations` samples.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+# The number of frames that is sorted, gathered or scanned at once
+CHUNK_FRAMES = 2**20
+
+# The number of frames times bootstrap samples that is processed at once
+BLOCK_ELEMENTS = 2**20
+
+# The number of samples drawn between convergence checks of the adaptive bootstrap
+ADAPTIVE_BLOCK_ITERATIONS = 250
+
+# The quantiles that are reported: the median and the 95% CI bounds
+QUANTILES = {"": 50, " 95% CI Lower Bound": 2.5, " 95% CI Upper Bound": 97.5}
+
+
+def bootstrap_metrics(
+    y_true,
+    y_pred,
+    patient_ids,
+    n_iterations=1000,
+    sample_size=100,
+    imbalance_ratio=1,
+    image_names=None,
+    stratify=False,
+    strata=None,
+    tolerance=None,
+    min_iterations=500,
+    max_iterations=20000,
+    num_patients=None,
+    directory=None,
+):
+    """
+    Compute metrics on the full test set and perform patient-level bootstrapping for confidence intervals.
+
+    Args:
+        y_true: Ground truth labels (per image)
+        y_pred: Predicted probabilities (per image)
+        patient_ids: Patient ID corresponding to each image
+        n_iterations: Number of bootstrap iterations, if not adaptive
+        sample_size: Number of neoplasia patients per bootstrap sample
+        imbalance_ratio: Ratio of NDBE to neoplasia patients
+        image_names: File name of each image, needed to stratify by lesion subtype
+        stratify: Whether to also report the metrics per center and per lesion subtype
+        strata: Boolean masks over the images per stratum, instead of those of stratify
+        tolerance: If set, draw samples until the Monte-Carlo standard errors are below it
+        min_iterations: Minimum number of bootstrap iterations, if adaptive
+        max_iterations: Maximum number of bootstrap iterations, if adaptive
+        num_patients: If set, patient_ids are codes from 0 to num_patients - 1
+        directory: If set, the sorted arrays are memmaps in this scratch directory
+
+    Returns:
+        Dictionary containing:
+            - full_dataset_metrics: AUC, AUPRC, PPV@90 on the full dataset
+            - bootstrapped_metrics: Median and 95% CI for each metric
+            - Details: kept apart from the leaderboard metrics, with
+                - Bootstrap: the number of iterations and their Monte-Carlo standard errors
+                - Strata: the metrics per stratum, if stratify or strata is set
+    """
+    # Arrays such as memmaps are not copied as a whole
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    patient_ids = np.asarray(patient_ids)
+
+    # Map each image to its patient
+    if num_patients is None:
+        patients, patient_index = np.unique(patient_ids, return_inverse=True)
+        num_patients = len(patients)
+    else:
+        patient_index = patient_ids
+
+    # Map each patient to a binary label (1 if any image is neoplasia)
+    patient_labels = np.zeros(num_patients, dtype=bool)
+    for start, stop in _chunks(len(y_true)):
+        patient_labels[patient_index[start:stop][y_true[start:stop] == 1]] = True
+
+    neoplasia_patients = np.flatnonzero(patient_labels)
+    ndbe_patients = np.flatnonzero(~patient_labels)
+
+    curves = _SortedCurves(
+        y_true=y_true, y_pred=y_pred, patient_index=patient_index, num_patients=num_patients, directory=directory
+    )
+
+    # --------------------
+    # Metrics on full dataset
+    # --------------------
+    auc_full, auprc_full, ppv_90_full = curves.full_metrics()
+
+    # --------------------
+    # Bootstrapping
+    # --------------------
+
+    if strata is None and stratify:
+        strata = stratify_by_center_and_subtype(y_true=y_true, patient_ids=patient_ids, image_names=image_names)
+    strata = {name: curves.sort(mask, name=f"stratum_{i}") for i, (name, mask) in enumerate((strata or {}).items())}
+
+    bootstrapped_metrics = []
+    bootstrapped_strata = {name: [] for name in strata}
+
+    if tolerance is None:
+        target, step = n_iterations, n_iterations
+    else:
+        target, step = max(min_iterations, 1), ADAPTIVE_BLOCK_ITERATIONS
+    draws = sample_size * (1 + imbalance_ratio)
+    block_size = max(1, BLOCK_ELEMENTS // min(len(y_true), draws * len(y_true) // num_patients + 1))
+
+    iterations = 0
+    while True:
+        size = min(block_size, step, target - iterations)
+        iterations += size
+
+        # Sample neoplasia and NDBE patients
+        sampled_neoplasia = np.random.choice(neoplasia_patients, size=(size, sample_size), replace=True)
+        sampled_ndbe = np.random.choice(ndbe_patients, size=(size, sample_size * imbalance_ratio), replace=True)
+        sampled_patients = np.concatenate([sampled_neoplasia, sampled_ndbe], axis=1)
+
+        # How often every patient, and so its images, is in each sample
+        offsets = np.arange(size)[:, None] * num_patients
+        patient_counts = np.bincount((sampled_patients + offsets).ravel(), minlength=size * num_patients)
+        rows, positions, weights = curves.expand(patient_counts.reshape(size, num_patients))
+
+        bootstrapped_metrics.append(curves.metrics(rows, positions, weights, num_rows=size))
+        for name, mask in strata.items():
+            keep = mask[positions]
+            bootstrapped_strata[name].append(curves.metrics(rows[keep], positions[keep], weights[keep], num_rows=size))
+
+        if iterations < target:
+            continue
+        standard_errors = _standard_errors(np.concatenate(bootstrapped_metrics))
+        if tolerance is None or max(standard_errors.values()) <= tolerance or iterations >= max_iterations:
+            break
+        target = min(iterations + step, max_iterations)
+
+    bootstrapped_metrics = np.concatenate(bootstrapped_metrics)
+
+    bootstrapped_summary = {
+        "Score": float(np.median(bootstrapped_metrics[:, 2])),
+
+        **_summary(bootstrapped_metrics),
+
+        'AUROC Full Dataset': float(auc_full),
+        'AUPRC Full Dataset': float(auprc_full),
+        'PPV@90RECALL Full Dataset': float(ppv_90_full),
+
+        "Details": {
+            "Bootstrap": {
+                "Iterations": iterations,
+                "Tolerance": tolerance,
+                "Converged": None if tolerance is None else max(standard_errors.values()) <= tolerance,
+                "Monte-Carlo Standard Errors": standard_errors,
+            },
+        },
+    }
+
+    if strata:
+        bootstrapped_summary["Details"]["Strata"] = {}
+        for name, mask in strata.items():
+            full = curves.full_metrics(mask=mask)
+            samples = np.concatenate(bootstrapped_strata[name])
+            bootstrapped_summary["Details"]["Strata"][name] = {
+                "Images": int(mask.sum()),
+                "Valid Iterations": int(np.isfinite(samples).all(axis=1).sum()),
+                **_summary(samples),
+                "AUROC Full Dataset": float(full[0]),
+                "AUPRC Full Dataset": float(full[1]),
+                "PPV@90RECALL Full Dataset": float(full[2]),
+            }
+
+    return bootstrapped_summary
+
+
+def stratify_by_center_and_subtype(*, y_true, patient_ids, image_names):
+    """
+    Returns a boolean mask over the images for every stratum, see stratify
+    """
+    center_names, centers = np.unique([center_of(pid) for pid in patient_ids], return_inverse=True)
+    subtypes = None
+    if image_names is not None:
+        subtype_names, subtype_codes = np.unique([subtype_of(name) for name in image_names], return_inverse=True)
+        subtypes = (subtype_codes, subtype_names)
+    return stratify(y_true=y_true, centers=(centers, center_names), subtypes=subtypes)
+
+
+def stratify(*, y_true, centers, subtypes=None):
+    """
+    Returns a boolean mask over the images for every stratum
+
+    Centers and subtypes are dictionary-encoded: a code per image and the name
+    of every code, the codes are not searched for again. A center stratum holds
+    all of its images, a subtype stratum holds its neoplastic images and all
+    NDBE images. Only strata with both classes are kept.
+    """
+    positive = np.asarray(y_true) == 1
+    strata = {}
+
+    codes, names = centers
+    for code, name in enumerate(names):
+        strata[f"Center {name}"] = codes == code
+
+    if subtypes is not None:
+        codes, names = subtypes
+        for code, name in enumerate(names):
+            strata[f"Subtype {name}"] = ((codes == code) & positive) | ~positive
+
+    return {
+        name: mask
+        for name, mask in strata.items()
+        if np.any(positive[mask]) and not np.all(positive[mask])
+    }
+
+
+def center_of(patient_id):
+    # The prefix of the patient ID: amc_105 -> amc
+    return str(patient_id).split("_")[0]
+
+
+def subtype_of(image_name):
+    # The fifth part of the file name: amc_105_wle_image_hgd_... -> hgd
+    parts = str(image_name).split("_")
+    return parts[4] if len(parts) > 4 else "unknown"
+
+
+class _SortedCurves:
+    """
+    Computes the metrics of weighted samples of the images, sorted by prediction
+
+    A block of samples is given as (row, position, weight) triples, sorted by
+    row and position: the sample, the sorted position of an image in it and how
+    often the image was drawn. Only drawn images are listed, so the work is that
+    of the samples, not of the dataset. Mirrors scikit-learn: thresholds are the
+    distinct predictions, tied predictions are resolved together.
+
+    With a directory, the arrays of one entry per image are memmaps in it.
+    """
+
+    def __init__(self, *, y_true, y_pred, patient_index, num_patients, directory=None):
+        self.directory = directory
+        if directory is not None:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+        self.size = len(y_pred)
+
+        ascending, sorted_pred = _argsort(y_pred, directory=directory)
+        self.order = ascending[::-1]
+        sorted_pred = sorted_pred[::-1]
+
+        self.y_sorted = _scratch(directory, "y_sorted", np.int8, self.size)
+        # The group of tied predictions of every sorted position
+        self.tie_group = _scratch(directory, "tie_group", np.int64, self.size)
+        group = 0
+        for start, stop in _chunks(self.size):
+            self.y_sorted[start:stop] = y_true[self.order[start:stop]]
+            changes = np.diff(sorted_pred[start:stop], prepend=sorted_pred[max(start - 1, 0)]) != 0
+            self.tie_group[start:stop] = group + np.cumsum(changes)
+            group = self.tie_group[stop - 1]
+
+        # The sorted positions of the images of every patient, patient after patient:
+        # a stable counting sort of the sorted positions by patient
+        counts = np.zeros(num_patients, dtype=np.int64)
+        for start, stop in _chunks(self.size):
+            counts += np.bincount(patient_index[start:stop], minlength=num_patients)
+        self.patient_offsets = np.r_[0, np.cumsum(counts)]
+        self.patient_positions = _scratch(directory, "patient_positions", np.int64, self.size)
+        next_slot = self.patient_offsets[:-1].copy()
+        for start, stop in _chunks(self.size):
+            patients = np.asarray(patient_index[self.order[start:stop]])
+            by_patient = np.argsort(patients, kind="stable")
+            sorted_patients = patients[by_patient]
+            rank = np.arange(len(by_patient)) - np.searchsorted(sorted_patients, sorted_patients)
+            self.patient_positions[next_slot[sorted_patients] + rank] = start + by_patient
+            next_slot += np.bincount(patients, minlength=num_patients)
+
+    def sort(self, values, *, name):
+        # The values of the images in sorted order, a memmap called name with a directory
+        result = _scratch(self.directory, name, np.asarray(values[:0]).dtype, self.size)
+        for start, stop in _chunks(self.size):
+            result[start:stop] = values[self.order[start:stop]]
+        return result
+
+    def expand(self, patient_counts):
+        # The triples of a block of samples, from how often every patient is in every sample
+        rows, patients = np.nonzero(patient_counts)
+        counts = patient_counts[rows, patients]
+        starts = self.patient_offsets[patients]
+        lengths = self.patient_offsets[patients + 1] - starts
+        ends = np.cumsum(lengths)
+        index = np.arange(lengths.sum()) + np.repeat(starts - ends + lengths, lengths)
+
+        rows = np.repeat(rows, lengths)
+        positions = self.patient_positions[index]
+        weights = np.repeat(counts, lengths).astype(np.float64)
+        # Within a sample, the positions of a patient are sorted runs already
+        order = np.argsort(rows * self.size + positions, kind="stable")
+        return rows[order], positions[order], weights[order]
+
+    def full_metrics(self, *, mask=None):
+        # AUROC, AUPRC and PPV@90 of all images, or of those in the sorted mask, a chunk at a time
+        total_tp = total_fp = 0
+        for start, stop in _chunks(self.size):
+            labels = self.y_sorted[start:stop] if mask is None else self.y_sorted[start:stop][mask[start:stop]]
+            total_tp += int(np.count_nonzero(labels))
+            total_fp += len(labels) - int(np.count_nonzero(labels))
+        if not total_tp or not total_fp:
+            return np.full(3, np.nan)
+
+        # The last point of the previous chunks, the curve starts at (0, 0)
+        tp = fp = previous_recall = previous_fpr = 0.0
+        auroc = auprc = 0.0
+        # The last point with recall <= 0.9, the curve of the precision starts at (0, 1)
+        x0, y0, ppv_90 = 0.0, 1.0, None
+        start = 0
+        while start < self.size:
+            # Chunks end at a threshold, so ties are not split between them
+            stop = min(start + CHUNK_FRAMES, self.size)
+            stop = int(np.searchsorted(self.tie_group, self.tie_group[stop - 1], side="right"))
+            keep = slice(None) if mask is None else np.asarray(mask[start:stop])
+            labels = self.y_sorted[start:stop][keep].astype(np.float64)
+            group = self.tie_group[start:stop][keep]
+            start = stop
+            if not len(labels):
+                continue
+
+            last = np.ones(len(labels), dtype=bool)
+            last[:-1] = group[1:] != group[:-1]
+            tps = tp + np.cumsum(labels)[last]
+            fps = fp + np.cumsum(1 - labels)[last]
+            tp, fp = tps[-1], fps[-1]
+
+            recall = tps / total_tp
+            fpr = fps / total_fp
+            precision = tps / (tps + fps)
+            previous = np.r_[previous_recall, recall[:-1]]
+            auroc += np.sum((fpr - np.r_[previous_fpr, fpr[:-1]]) * (recall + previous) / 2)
+            auprc += np.sum((recall - previous) * precision)
+            previous_recall, previous_fpr = recall[-1], fpr[-1]
+
+            # np.interp(0.9, recall, precision): interpolate from the last point with
+            # recall <= 0.9 to the next
+            if ppv_90 is None:
+                below = int(np.count_nonzero(recall <= 0.9))
+                if below:
+                    x0, y0 = recall[below - 1], precision[below - 1]
+                if below < len(recall):
+                    x1, y1 = recall[below], precision[below]
+                    ppv_90 = y0 if x0 == 0.9 else y0 + (y1 - y0) / (x1 - x0) * (0.9 - x0)
+
+        return np.array([auroc, auprc, ppv_90])
+
+    def metrics(self, rows, positions, weights, *, num_rows):
+        # Returns (num_rows, 3): AUROC, AUPRC and PPV@90 per sample
+        result = np.full((num_rows, 3), np.nan)
+        if not len(rows):
+            return result
+
+        tp = weights * self.y_sorted[positions]
+        fp = weights - tp
+        total_tp = np.bincount(rows, weights=tp, minlength=num_rows)
+        total_fp = np.bincount(rows, weights=fp, minlength=num_rows)
+
+        # The counts at the last image of every threshold, cumulative within a sample
+        group = self.tie_group[positions]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = (rows[1:] != rows[:-1]) | (group[1:] != group[:-1])
+        tps = (np.cumsum(tp) - np.r_[0, np.cumsum(total_tp)[:-1]][rows])[last]
+        fps = (np.cumsum(fp) - np.r_[0, np.cumsum(total_fp)[:-1]][rows])[last]
+        rows = rows[last]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            recall = tps / total_tp[rows]
+            fpr = fps / total_fp[rows]
+            precision = tps / (tps + fps)
+
+            # The previous point of the curve, the first one of a sample follows (0, 0)
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = rows[1:] != rows[:-1]
+            previous_recall = np.where(first, 0, np.roll(recall, 1))
+            previous_fpr = np.where(first, 0, np.roll(fpr, 1))
+
+            auroc = np.bincount(rows, weights=(fpr - previous_fpr) * (recall + previous_recall) / 2, minlength=num_rows)
+            auprc = np.bincount(rows, weights=(recall - previous_recall) * precision, minlength=num_rows)
+
+            # np.interp(0.9, recall, precision) with the curve starting at (0, 1):
+            # interpolate from the last point with recall <= 0.9 to the next
+            start = np.searchsorted(rows, np.arange(num_rows))
+            below = np.bincount(rows, weights=recall <= 0.9, minlength=num_rows).astype(int)
+            j = np.clip(start + below - 1, 0, len(rows) - 1)
+            k = np.clip(start + below, 0, len(rows) - 1)
+            x0 = np.where(below > 0, recall[j], 0.0)
+            y0 = np.where(below > 0, precision[j], 1.0)
+            x1, y1 = recall[k], precision[k]
+            ppv_90 = np.where(x0 == 0.9, y0, y0 + (y1 - y0) / (x1 - x0) * (0.9 - x0))
+
+        # A sample without positives or negatives has no curve
+        defined = (total_tp > 0) & (total_fp > 0)
+        result[defined] = np.stack([auroc, auprc, ppv_90], axis=1)[defined]
+        return result
+
+
+# The columns of the bootstrapped samples
+METRIC_COLUMNS = {"PPV@90RECALL": 2, "AUROC": 0, "AUPRC": 1}
+
+
+def _summary(samples):
+    # Median and 95% CI of every metric, ignoring samples where it is undefined
+    summary = {}
+    for name, column in METRIC_COLUMNS.items():
+        values = samples[:, column]
+        for suffix, q in QUANTILES.items():
+            summary[name + suffix] = None if np.isnan(values).all() else float(np.nanpercentile(values, q))
+    return summary
+
+
+def _standard_errors(samples):
+    """
+    The Monte-Carlo standard error of every reported quantile
+
+    Distribution-free: the order statistics n * q -/+ sqrt(n * q * (1 - q))
+    bound a one standard error interval of the q-quantile, as the number of
+    samples below it is binomial. Half its width is the standard error.
+    """
+    standard_errors = {}
+    n = len(samples)
+    for name, column in METRIC_COLUMNS.items():
+        values = np.sort(samples[:, column])
+        for suffix, q in QUANTILES.items():
+            q /= 100
+            spread = np.sqrt(n * q * (1 - q))
+            lower = int(np.clip(np.floor(n * q - spread), 0, n - 1))
+            upper = int(np.clip(np.ceil(n * q + spread), 0, n - 1))
+            standard_errors[name + suffix] = float(values[upper] - values[lower]) / 2
+    return standard_errors
+
+
+def _chunks(size):
+    # The (start, stop) of every chunk of frames
+    for start in range(0, size, CHUNK_FRAMES):
+        yield start, min(start + CHUNK_FRAMES, size)
+
+
+def _scratch(directory, name, dtype, size):
+    # An array of one entry per image, in memory or a memmap in the directory
+    if directory is None:
+        return np.empty(size, dtype=dtype)
+    return np.memmap(Path(directory) / f"{name}.bin", dtype=dtype, mode="w+", shape=(size,))
+
+
+def _argsort(values, *, directory):
+    """
+    Returns the stable ascending argsort of the values and the sorted values
+
+    With a directory, the chunks are sorted one at a time and the sorted runs
+    are merged pairwise, a chunk of each at a time, between two pairs of memmaps.
+    """
+    if directory is None:
+        order = np.argsort(values, kind="stable")
+        return order, np.asarray(values)[order]
+
+    size = len(values)
+    buffers = [
+        (_scratch(directory, f"sort_keys_{i}", np.float64, size), _scratch(directory, f"sort_order_{i}", np.int64, size))
+        for i in range(2)
+    ]
+    keys, order = buffers[0]
+    for start, stop in _chunks(size):
+        chunk = np.asarray(values[start:stop], dtype=np.float64)
+        chunk_order = np.argsort(chunk, kind="stable")
+        keys[start:stop] = chunk[chunk_order]
+        order[start:stop] = start + chunk_order
+
+    run = CHUNK_FRAMES
+    while run < size:
+        (keys, order), (merged_keys, merged_order) = buffers
+        for lo in range(0, size, 2 * run):
+            _merge(keys, order, merged_keys, merged_order, lo=lo, mid=min(lo + run, size), hi=min(lo + 2 * run, size))
+        buffers.reverse()
+        run *= 2
+    return buffers[0][1], buffers[0][0]
+
+
+def _merge(keys, order, merged_keys, merged_order, *, lo, mid, hi):
+    # Merges the sorted runs [lo, mid) and [mid, hi), the first one first on ties
+    i, j, k = lo, mid, lo
+    while i < mid or j < hi:
+        a = keys[i:min(i + CHUNK_FRAMES, mid)]
+        b = keys[j:min(j + CHUNK_FRAMES, hi)]
+        # Take everything up to the smaller of the last keys, ties of b wait for those of a
+        if not len(b):
+            na, nb = len(a), 0
+        elif not len(a):
+            na, nb = 0, len(b)
+        elif a[-1] <= b[-1]:
+            na, nb = len(a), int(np.searchsorted(b, a[-1], side="left"))
+        else:
+            na, nb = int(np.searchsorted(a, b[-1], side="right")), len(b)
+
+        chunk_keys = np.concatenate([a[:na], b[:nb]])
+        chunk_order = np.concatenate([order[i:i + na], order[j:j + nb]])
+        by_key = np.argsort(chunk_keys, kind="stable")
+        merged_keys[k:k + na + nb] = chunk_keys[by_key]
+        merged_order[k:k + na + nb] = chunk_order[by_key]
+        i, j, k = i + na, j + nb, k + na + nb
@@ -2,12 +2,15 @@ import multiprocessing
 import os
 import sys
 import traceback
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from multiprocessing import Manager, Process
 from pathlib import Path
 
 import psutil
 
+# Predictions are submitted to the pool lazily, this many per worker at most
+MAX_IN_FLIGHT_PER_WORKER = 4
+
 
 class PredictionProcessingError(Exception):
     pass
@@ -49,7 +52,7 @@ def get_max_workers():
     )
 
 
-def run_prediction_processing(*, fn, predictions):
+def run_prediction_processing(*, fn, predictions, profiler=None):
     """
     Processes predictions in a separate process.
 
@@ -64,8 +67,14 @@ def run_prediction_processing(*, fn, predictions):
     fn : function
         Function to execute that will process each prediction
 
-    predictions : list
-        List of predictions.
+    predictions : iterable
+        The predictions, e.g. a list or a picklable stream that parses them
+        incrementally. It is iterated in the processing process, and each
+        prediction is submitted as soon as it is read.
+
+    profiler : rare25.profiling.Profiler, optional
+        Profiles the processing process too, e.g. the parsing of a stream.
+        Wrap fn with it to profile the workers.
 
     Returns
     -------
@@ -74,22 +83,31 @@ def run_prediction_processing(*, fn, predictions):
     with Manager() as manager:
         results = manager.dict()
         errors = manager.dict()
+        submitted = manager.dict()
 
         pool_worker = _start_pool_worker(
+            target=profiler.wrap(_pool_worker) if profiler else _pool_worker,
             fn=fn,
             predictions=predictions,
             max_workers=get_max_workers(),
             results=results,
             errors=errors,
+            submitted=submitted,
         )
         try:
             pool_worker.join()
         finally:
             pool_worker.terminate()
 
+        if pool_worker.exitcode != 0 and not errors:
+            # Died without reporting why, e.g. killed for running out of memory
+            errors["predictions"] = f"The {pool_worker.name} process exited with code {pool_worker.exitcode}"
+
         failed = set(errors.keys())
         succeeded = set(results.keys())
-        canceled = set(p["pk"] for p in predictions) - (failed | succeeded)
+        # A stream is only known as far as it was read
+        known = [p["pk"] for p in predictions] if isinstance(predictions, list) else submitted.keys()
+        canceled = set(known) - (failed | succeeded)
 
         display_processing_report(succeeded, canceled, failed)
 
@@ -105,9 +123,9 @@ def run_prediction_processing(*, fn, predictions):
         return list(results.values())
 
 
-def _start_pool_worker(fn, predictions, max_workers, results, errors):
+def _start_pool_worker(target, fn, predictions, max_workers, results, errors, submitted):
     process = Process(
-        target=_pool_worker,
+        target=target,
         name="PredictionProcessing",
         kwargs=dict(
             fn=fn,
@@ -115,6 +133,7 @@ def _start_pool_worker(fn, predictions, max_workers, results, errors):
             max_workers=max_workers,
             results=results,
             errors=errors,
+            submitted=submitted,
         ),
     )
     process.start()
@@ -122,39 +141,55 @@ def _start_pool_worker(fn, predictions, max_workers, results, errors):
     return process
 
 
-def _pool_worker(*, fn, predictions, max_workers, results, errors):
+def _pool_worker(*, fn, predictions, max_workers, results, errors, submitted):
     caught_exception = False
+
+    def handle(future, prediction_pk):
+        nonlocal caught_exception
+        if future.cancelled():
+            return
+
+        error = future.exception()
+
+        if error:
+            # Cannot pickle tracestacks, so format it here
+            tb_exception = traceback.TracebackException.from_exception(
+                error
+            )
+            errors[prediction_pk] = "".join(tb_exception.format())
+
+            if not caught_exception:  # Hard stop
+                caught_exception = True
+
+                executor.shutdown(wait=False, cancel_futures=True)
+                _terminate_child_processes()
+        else:
+            results[prediction_pk] = future.result()
+
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
         try:
-            # Submit the processing tasks of the predictions
-            futures = [
-                executor.submit(fn, prediction) for prediction in predictions
-            ]
-            future_to_predictions = {
-                future: item
-                for future, item in zip(futures, predictions, strict=True)
-            }
-
-            for future in as_completed(future_to_predictions):
-                prediction = future_to_predictions[future]
-                prediction_pk = prediction["pk"]
-
-                error = future.exception()
-
-                if error:
-                    # Cannot pickle tracestacks, so format it here
-                    tb_exception = traceback.TracebackException.from_exception(
-                        error
-                    )
-                    errors[prediction_pk] = "".join(tb_exception.format())
-
-                    if not caught_exception:  # Hard stop
-                        caught_exception = True
-
-                        executor.shutdown(wait=False, cancel_futures=True)
-                        _terminate_child_processes()
-                else:
-                    results[prediction_pk] = future.result()
+            # Submit the processing tasks as the predictions come in, e.g. while
+            # they are parsed, but keep a bounded number of them in flight
+            future_to_prediction_pk = {}
+            for prediction in predictions:
+                if len(future_to_prediction_pk) >= max_workers * MAX_IN_FLIGHT_PER_WORKER:
+                    done, _ = wait(future_to_prediction_pk, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        handle(future, future_to_prediction_pk.pop(future))
+                if caught_exception:
+                    break
+
+                future = executor.submit(fn, prediction)
+                future_to_prediction_pk[future] = prediction["pk"]
+                submitted[prediction["pk"]] = True
+
+            for future in as_completed(future_to_prediction_pk):
+                handle(future, future_to_prediction_pk[future])
+
+        except Exception as e:
+            # E.g. a truncated or malformed stream: no partial results may be used
+            errors["predictions"] = "".join(traceback.TracebackException.from_exception(e).format())
+            executor.shutdown(wait=False, cancel_futures=True)
 
         finally:
             # Be aggresive in cleaning up any left-over processes
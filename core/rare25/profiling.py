@@ -0,0 +1,130 @@
+"""
+Opt-in cProfile profiling of a process and the workers it spawns.
+
+The parent is profiled with `Profiler.profile()`, functions that run in worker
+processes are wrapped with `Profiler.wrap(fn)`. Every worker call dumps its own
+stats; when profiling ends these are merged with those of the parent and
+written to the output directory:
+
+  * parent.prof, workers.prof and merged.prof: pstats files (snakeviz, flameprof, ...)
+  * merged.folded: approximate collapsed stacks for flamegraph.pl or speedscope
+  * top.txt: the top-N functions by cumulative and by internal time
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class Profiler:
+    def __init__(self, *, output_directory, top_n=50):
+        self.output_directory = Path(output_directory)
+        self.top_n = top_n
+        self.worker_directory = Path(tempfile.mkdtemp(prefix="rare25-profile-"))
+
+    def wrap(self, fn):
+        # Picklable, so it can be sent to worker processes
+        return _ProfiledCall(fn=fn, directory=self.worker_directory)
+
+    @contextmanager
+    def profile(self):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield self
+        finally:
+            profile.disable()
+            self.write_results(parent=profile)
+
+    def write_results(self, *, parent):
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+
+        parent_stats = pstats.Stats(parent)
+        parent_stats.dump_stats(self.output_directory / "parent.prof")
+
+        worker_files = sorted(str(p) for p in self.worker_directory.glob("*.prof"))
+        merged = pstats.Stats(parent)
+        if worker_files:
+            workers = pstats.Stats(*worker_files)
+            workers.dump_stats(self.output_directory / "workers.prof")
+            merged.add(*worker_files)
+        merged.dump_stats(self.output_directory / "merged.prof")
+
+        with open(self.output_directory / "merged.folded", "w") as f:
+            for stack, microseconds in collapsed_stacks(merged).items():
+                f.write(f"{stack} {microseconds}\n")
+
+        with open(self.output_directory / "top.txt", "w") as f:
+            f.write(f"Profiled the parent and {len(worker_files)} worker calls\n\n")
+            for sort_key in ("cumulative", "tottime"):
+                merged.stream = io.StringIO()
+                merged.sort_stats(sort_key).print_stats(self.top_n)
+                f.write(f"=== Top {self.top_n} by {sort_key} ===\n")
+                f.write(merged.stream.getvalue())
+
+        shutil.rmtree(self.worker_directory, ignore_errors=True)
+
+        print(f"Wrote profiling results of the parent and {len(worker_files)} worker calls to {self.output_directory}")
+
+
+class _ProfiledCall:
+    def __init__(self, *, fn, directory):
+        self.fn = fn
+        self.directory = directory
+
+    def __call__(self, *args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            profile.dump_stats(self.directory / f"worker-{os.getpid()}-{uuid.uuid4().hex}.prof")
+
+
+def collapsed_stacks(stats, *, max_depth=64):
+    """
+    Approximates collapsed stacks ("root;caller;callee microseconds") from pstats
+
+    cProfile only records caller -> callee edges, not whole stacks, so the
+    internal time of every function is attributed once, to the path along its
+    heaviest callers (by cumulative time of the edge). The stacks thus add up to
+    the total internal time, and there is at most one per function.
+    """
+    heaviest_caller = {
+        func: max(callers, key=lambda caller: callers[caller][3]) if callers else None
+        for func, (_, _, _, _, callers) in stats.stats.items()
+    }
+    paths = {}
+
+    def path_of(func):
+        if func not in paths:
+            path = [func]
+            caller = heaviest_caller[func]
+            while caller is not None and caller not in path and len(path) < max_depth:
+                path.append(caller)
+                caller = heaviest_caller.get(caller)
+            paths[func] = ";".join(_label(f) for f in reversed(path))
+        return paths[func]
+
+    stacks = {}
+    for func, (_, _, tottime, _, _) in stats.stats.items():
+        own = int(tottime * 1e6)
+        if own > 0:
+            key = path_of(func)
+            stacks[key] = stacks.get(key, 0) + own
+
+    return stacks
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == "~":  # Built-in functions
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
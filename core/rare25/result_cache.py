@@ -0,0 +1,71 @@
+"""
+Content-addressed cache of processed evaluation jobs.
+
+Processing a job matches its likelihoods with the ground truth. The result only
+depends on the likelihood file, the name of the input stack and the ground
+truth, so it is stored under a hash of exactly those. Re-evaluating the same
+outputs, e.g. after changing a metric or the bootstrap parameters, then skips
+reading the ground truth for every job and only runs the metric stage.
+
+Results are stored as one .npz per job: the predictions as float64, the labels
+as int8 and the patient ids and image names as fixed-width strings.
+"""
+
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+# Bump when the processing of a job or the stored format changes
+FORMAT_VERSION = "1"
+
+COLUMNS = {
+    "prediction": np.float64,
+    "ground_truth": np.int8,
+    "patient_id": np.str_,
+    "image_name": np.str_,
+}
+
+
+class ResultCache:
+    def __init__(self, *, directory, ground_truth_version):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ground_truth_version = ground_truth_version
+
+    def key(self, *, likelihoods_location, image_name):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(FORMAT_VERSION.encode())
+        digest.update(self.ground_truth_version.encode())
+        digest.update(image_name.encode())
+        _update_with_file(digest, likelihoods_location)
+        return digest.hexdigest()
+
+    def get(self, key):
+        path = self.directory / f"{key}.npz"
+        if not path.is_file():
+            return None
+        with np.load(path) as stored:
+            return {column: stored[column] for column in COLUMNS}
+
+    def put(self, key, result):
+        columns = {column: np.asarray(result[column], dtype=dtype) for column, dtype in COLUMNS.items()}
+        # Workers may store the same result concurrently, renaming keeps the file whole
+        tmp_path = self.directory / f".{key}.{uuid.uuid4().hex}.npz"
+        np.savez(tmp_path, **columns)
+        os.replace(tmp_path, self.directory / f"{key}.npz")
+
+
+def file_version(location):
+    # The ground truth version: a hash of its content
+    digest = hashlib.blake2b(digest_size=20)
+    _update_with_file(digest, location)
+    return digest.hexdigest()
+
+
+def _update_with_file(digest, location):
+    with open(location, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
@@ -0,0 +1,229 @@
+import time
+
+import torch
+import torch.nn.functional as F
+import timm
+from PIL import Image
+import numpy as np
+from torchvision import transforms
+from torchvision.transforms import functional as TF
+
+from rare25.instrumentation import timings
+
+TTA_AGGREGATIONS = ("mean_logit", "max_prob")
+
+
+class TimmClassificationModel:
+    def __init__(
+        self,
+        model_name: str,
+        weights: None,
+        num_classes: int = 1,
+        device: torch.device = None,
+        batch_size: int = 32,
+        tta: tuple = (),
+        tta_aggregation: str = "mean_logit",
+        embedding_cache=None,
+        embedding_cache_mib: int = 1024,
+    ):
+        """
+        Wrapper for creating and managing a classification model using timm.
+
+        :param model_name: Name of the model architecture from timm.
+        :param device: PyTorch device to move the model to. Defaults to 'cuda' if available.
+        :param num_classes: Number of output classes. Default is 1.
+        :param pretrained: Whether to load pretrained weights. Default is True.
+        :param batch_size: Number of images per forward pass, test-time augmented views included.
+        :param tta: Test-time augmentation views next to the original image, e.g.
+            ("hflip", "vflip", "rot10", "rot-10", "crop0.875"). Default is none.
+        :param tta_aggregation: How the views are combined: 'mean_logit' or 'max_prob'.
+        :param embedding_cache: Directory of an on-disk cache of features and logits of
+            preprocessed frames, repeated frames then skip the backbone. Default is no cache.
+        :param embedding_cache_mib: Size cap of the embedding cache of this model in MiB.
+        """
+        if tta_aggregation not in TTA_AGGREGATIONS:
+            raise ValueError(f"Unknown TTA aggregation {tta_aggregation!r}, expected one of {TTA_AGGREGATIONS}")
+
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        with timings.stage("model construction"):
+            self.model = timm.create_model(model_name, pretrained=False, num_classes=num_classes)
+        with timings.stage("weight load"):
+            self.model.load_state_dict(torch.load(weights, map_location=self.device), strict=True)
+            self.model.to(self.device).eval()
+        self.transform = self.default_transforms()
+        self.batch_size = batch_size
+        self.tta_views = [("identity", lambda x: x)] + [(name, tta_view(name)) for name in tta]
+        self.tta_aggregation = tta_aggregation
+
+        self.num_classes = num_classes
+        self.cache = None
+        if embedding_cache is not None:
+            from rare25.embedding_cache import EmbeddingCache, model_key
+
+            self.cache = EmbeddingCache(
+                embedding_cache,
+                model_key=model_key(model_name=model_name, weights=weights, transform=self.transform),
+                feature_dim=self.model.num_features,
+                num_outputs=num_classes,
+                max_mib=embedding_cache_mib,
+            )
+
+    def predict(self, images: list[np.ndarray]):
+        """
+        Accepts a list of numpy images (HWC, uint8 or float),
+        converts them to PIL Images, applies transforms, and runs inference.
+
+        Images are processed in batches; all test-time augmented views of the
+        images in a batch go through the same forward pass.
+        """
+        num_views = len(self.tta_views)
+
+        probs = []
+        tta_seconds = None
+        for batch in self.preprocess_batches(images, images_per_batch=max(1, self.batch_size // num_views)):
+            probs.extend(self.predict_batch(batch).cpu().tolist())
+            if timings.profile and num_views > 1 and tta_seconds is None:
+                # Once, when profiling: the cost of TTA on the first batch
+                tta_seconds, baseline_seconds = self.tta_seconds(batch)
+
+        if self.cache is not None:
+            self.cache.flush()
+
+        if tta_seconds is not None:
+            print(
+                f"TTA with {num_views} views ({', '.join(name for name, _ in self.tta_views)}): "
+                f"{tta_seconds * 1e3:.2f} ms per image against {baseline_seconds * 1e3:.2f} ms without TTA, "
+                f"{(tta_seconds - baseline_seconds) / (num_views - 1) * 1e3:+.2f} ms per added view"
+            )
+
+        return probs
+
+    def preprocess_batches(self, images, *, images_per_batch):
+        # Yields batches of transformed images (N, C, H, W), on the CPU
+        for start in range(0, len(images), images_per_batch):
+            with timings.stage("preprocessing"):
+                batch = torch.stack([
+                    self.transform(Image.fromarray(img) if isinstance(img, np.ndarray) else img)
+                    for img in images[start:start + images_per_batch]
+                ])
+            yield batch
+
+    def predict_batch(self, batch):
+        # Returns one probability per image of a preprocessed batch
+        num_views = len(self.tta_views)
+        with torch.no_grad():
+            keys = self.view_keys(batch) if self.cache is not None else None
+            batch = batch.to(self.device)
+            # (num_views * batch, C, H, W), view-major
+            views = torch.cat([view(batch) for _, view in self.tta_views])
+            if keys is None:
+                with timings.stage("forward"):
+                    logits = self.model(views)
+            else:
+                logits = self.cached_forward(views, keys=keys)
+            return self.aggregate(logits.view(num_views, len(batch)))
+
+    def tta_seconds(self, batch):
+        # The forward time per image of a preprocessed batch with and without TTA, without the cache
+        # Each is timed after a warm-up pass of the same shape, so both are measured warm
+        with torch.no_grad():
+            batch = batch.to(self.device)
+            views = torch.cat([view(batch) for _, view in self.tta_views])
+            seconds = []
+            for inputs in (views, batch):
+                self.model(inputs).cpu()
+                start = time.perf_counter()
+                self.model(inputs).cpu()
+                seconds.append((time.perf_counter() - start) / len(batch))
+            return seconds
+
+    def view_keys(self, batch):
+        from rare25.embedding_cache import frame_keys, view_key
+
+        # View-major, like the views of the batch
+        with timings.stage("cache lookup"):
+            keys = frame_keys(batch)
+            return [view_key(key, name) for name, _ in self.tta_views for key in keys]
+
+    def cached_forward(self, views, *, keys):
+        # Only runs the backbone on the views that are not in the cache yet
+        with timings.stage("cache lookup"):
+            hit, _, cached_logits = self.cache.get(keys)
+            logits = torch.empty((len(keys), self.num_classes), device=self.device)
+            logits[torch.from_numpy(hit).to(self.device)] = torch.from_numpy(cached_logits).to(self.device)
+
+        if not hit.all():
+            missing = torch.from_numpy(~hit).to(self.device)
+            with timings.stage("forward"):
+                features = self.features(views[missing])
+                logits[missing] = self.model.get_classifier()(features)
+            with timings.stage("cache store"):
+                self.cache.put(
+                    [key for key, is_hit in zip(keys, hit, strict=True) if not is_hit],
+                    features=features.cpu().numpy(),
+                    logits=logits[missing].cpu().numpy(),
+                )
+
+        return logits
+
+    def features(self, batch):
+        # Pooled backbone features (N, num_features) of a preprocessed batch, without TTA
+        with torch.no_grad():
+            return self.model.forward_head(self.model.forward_features(batch.to(self.device)), pre_logits=True)
+
+    def predict_features(self, features):
+        """
+        Runs only the classification head on pooled features, e.g. from a FeatureStore
+
+        Returns the logits as a (N,) numpy array
+        """
+        with torch.no_grad():
+            # Copies, features are often a read-only memmap
+            features = torch.tensor(np.asarray(features, dtype=np.float32), device=self.device)
+            return self.model.get_classifier()(features).view(len(features)).cpu().numpy()
+
+    def aggregate(self, logits):
+        # Combines the logits of shape (views, images) into one probability per image
+        if self.tta_aggregation == "mean_logit":
+            return torch.sigmoid(logits.mean(dim=0))
+        return torch.sigmoid(logits).max(dim=0).values
+
+    @staticmethod
+    def default_transforms():
+        return transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406],
+                                 std=[0.229, 0.224, 0.225])
+        ])
+
+
+def tta_view(name):
+    """
+    Returns a function that creates a test-time augmented view of a batch (N, C, H, W)
+
+    'hflip' and 'vflip' flip, 'rot<degrees>' rotates (e.g. 'rot10' or 'rot-10')
+    and 'crop<scale>' takes a center crop of that scale and resizes it back.
+    """
+    if name == "hflip":
+        return lambda x: torch.flip(x, dims=[3])
+    if name == "vflip":
+        return lambda x: torch.flip(x, dims=[2])
+    if name.startswith("rot"):
+        angle = float(name[3:])
+        return lambda x: TF.rotate(x, angle)
+    if name.startswith("crop"):
+        scale = float(name[4:])
+        if not 0 < scale <= 1:
+            raise ValueError(f"Crop scale of {name!r} must be in (0, 1]")
+
+        def crop(x):
+            height, width = x.shape[-2:]
+            crop_height, crop_width = round(height * scale), round(width * scale)
+            top, left = (height - crop_height) // 2, (width - crop_width) // 2
+            cropped = x[..., top:top + crop_height, left:left + crop_width]
+            return F.interpolate(cropped, size=(height, width), mode="bilinear", align_corners=False)
+
+        return crop
+
+    raise ValueError(f"Unknown TTA view {name!r}")
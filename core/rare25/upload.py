@@ -0,0 +1,367 @@
+"""
+Uploads cases to a Grand-Challenge archive with GC-API.
+
+Cases are discovered by scanning the cases root once; the discovered file
+lists are reused by the pre-flight check and the upload.
+
+Cases are uploaded concurrently by a bounded pool of workers that share one
+gcapi.Client, each case is retried with exponential backoff. To try the upload
+against a local stand-in of the archive API, run
+`python -m rare25.archive_stand_in`.
+
+Progress is recorded in a local journal (SQLite). Re-running skips cases
+that were completed before, resumes cases of which the archive item was
+already created, and skips cases whose content was already uploaded.
+"""
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from gcapi import SocketValueSpec
+
+
+# Number of cases that are uploaded at the same time
+MAX_WORKERS = int(os.getenv("UPLOAD_MAX_WORKERS", 4))
+
+# Per-case retries, waiting RETRY_BACKOFF_SECONDS * 2**attempt (plus jitter) in between
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 2
+
+# Relative path within a case -> socket slug
+SOCKET_RELATIVE_PATHS = {
+    "images/stacked-barretts-esophagus-endoscopy": "stacked-barretts-esophagus-endoscopy-images",
+}
+
+EXPECTED_SOCKETS = [
+    {
+        "stacked-barretts-esophagus-endoscopy-images",
+    },
+]
+
+
+def main(*, client, archive_slug, cases_root, journal_path):
+    """
+    Uploads all cases in cases_root/interface_*/case_*/ to an archive
+
+    client is the gcapi.Client to upload with, the upload state is recorded in
+    the journal at journal_path. Returns the exit code: 1 if any case failed to
+    upload.
+    """
+    cases = discover_cases(cases_root)
+    assert cases, f"No cases found in {cases_root}"
+
+    journal = UploadJournal(journal_path, cases_root=cases_root)
+    try:
+        pre_flight_check(cases=cases, journal=journal)
+        failed = upload_files(cases=cases, journal=journal, client=client, archive_slug=archive_slug)
+    finally:
+        journal.close()
+    return 1 if failed else 0
+
+
+def pre_flight_check(*, cases, journal=None):
+    # Perform a sanity-check to see if everything is in place
+    # before we start uploading files to the archive
+
+    for case in cases:
+        contents = prepare_contents(case)
+        if journal is not None:
+            # Hash the files once, the upload stage reuses the journaled hashes
+            journal.content_hash(contents)
+
+
+def upload_files(*, cases, journal, client, archive_slug):
+    # Uploads files to the Grand-Challenge archive, returns the cases that failed
+
+    archive = client.archives.detail(slug=archive_slug)
+    print(f"Uploading {len(cases)} cases to {archive.title} using {MAX_WORKERS} workers")
+
+    progress = UploadProgress(total=len(cases))
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        future_to_case = {
+            executor.submit(
+                upload_case, case=case, archive=archive, journal=journal, client=client
+            ): case
+            for case in cases
+        }
+        for future in as_completed(future_to_case):
+            case = future_to_case[future]
+            try:
+                status, num_bytes = future.result()
+            except Exception as e:
+                failed.append(case)
+                progress.update(case=case, status="failed", num_bytes=0, error=e)
+            else:
+                progress.update(case=case, status=status, num_bytes=num_bytes)
+
+    progress.report()
+
+    return failed
+
+
+def upload_case(*, case, archive, journal, client):
+    # Uploads a single case, retrying with exponential backoff on failure
+    # Returns the status ("uploaded", "resumed", "skipped" or "duplicate") and uploaded bytes
+    contents = prepare_contents(case)
+    num_bytes = sum(f.stat().st_size for files in contents.values() for f in files)
+
+    case_key = journal.case_key(case)
+    content_hash = journal.content_hash(contents)
+    entry = journal.get_case(case_key)
+
+    if entry and entry["status"] == "completed" and entry["content_hash"] == content_hash:
+        return "skipped", 0
+
+    if journal.find_completed(content_hash=content_hash, exclude_case_key=case_key):
+        # The exact same content was already uploaded as another case
+        return "duplicate", 0
+
+    # Re-use the archive item of an earlier, interrupted, run
+    archive_item_pk = entry["archive_item_pk"] if entry else None
+    status = "resumed" if archive_item_pk else "uploaded"
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            if archive_item_pk is None:
+                # Only create the item once so retries do not leave duplicates behind
+                archive_item = client.archive_items.create(archive=archive.api_url, values=[])
+                archive_item_pk = archive_item.pk
+                journal.set_case(case_key, content_hash=content_hash, archive_item_pk=archive_item_pk, status="created")
+            client.update_archive_item(
+                archive_item_pk=archive_item_pk,
+                values=[SocketValueSpec(socket_slug=slug, files=files) for slug, files in contents.items()],
+            )
+            journal.set_case(case_key, content_hash=content_hash, archive_item_pk=archive_item_pk, status="completed")
+            return status, num_bytes
+        except Exception as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = RETRY_BACKOFF_SECONDS * 2**attempt * random.uniform(1, 1.5)
+            print(f"Uploading {case} failed ({e!r}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class UploadProgress:
+    """Thread-safe progress and throughput reporting of the upload"""
+
+    def __init__(self, *, total):
+        self.total = total
+        self.done = 0
+        self.statuses = {}
+        self.num_bytes = 0
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, *, case, status, num_bytes, error=None):
+        with self.lock:
+            self.done += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.num_bytes += num_bytes
+            elapsed = time.monotonic() - self.start
+            if error is not None:
+                status = f"FAILED ({error!r})"
+            eta = elapsed / self.done * (self.total - self.done)
+            print(
+                f"[{self.done}/{self.total}] {status}: {case} | "
+                f"{self.num_bytes / 2**20 / max(elapsed, 1e-9):.2f} MiB/s, ETA {eta:.0f}s"
+            )
+
+    def report(self):
+        elapsed = time.monotonic() - self.start
+        num_uploaded = self.statuses.get("uploaded", 0) + self.statuses.get("resumed", 0)
+        print("UPLOAD REPORT")
+        for status in ("uploaded", "resumed", "skipped", "duplicate", "failed"):
+            print(f"{status.capitalize()}: {self.statuses.get(status, 0)}/{self.total}")
+        print(
+            f"Uploaded {self.num_bytes / 2**20:.1f} MiB in {elapsed:.1f}s "
+            f"({self.num_bytes / 2**20 / max(elapsed, 1e-9):.2f} MiB/s, "
+            f"{num_uploaded / max(elapsed, 1e-9):.2f} cases/s)"
+        )
+
+
+class UploadJournal:
+    """
+    SQLite journal of the upload state, shared by the upload workers
+
+    Cases are keyed by their socket -> path mapping and record the content hash,
+    the archive item pk and a status ("created" or "completed"). File hashes are
+    cached by path, size and modification time so files are only hashed once.
+    """
+
+    def __init__(self, path, *, cases_root):
+        self.cases_root = cases_root
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.file_hashes = {}
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cases ("
+                "case_key TEXT PRIMARY KEY, content_hash TEXT, archive_item_pk TEXT, "
+                "status TEXT, updated_at REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS cases_content_hash ON cases (content_hash)")
+
+    def close(self):
+        self.connection.close()
+
+    def case_key(self, case):
+        # Relative to the cases root, so the journal survives moving the data
+        return json.dumps(
+            {slug: Path(os.path.relpath(path, self.cases_root)).as_posix() for slug, path in case.items()},
+            sort_keys=True,
+        )
+
+    def get_case(self, case_key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT content_hash, archive_item_pk, status FROM cases WHERE case_key = ?",
+                (case_key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("content_hash", "archive_item_pk", "status"), row, strict=True))
+
+    def set_case(self, case_key, *, content_hash, archive_item_pk, status):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?, ?)",
+                (case_key, content_hash, str(archive_item_pk), status, time.time()),
+            )
+
+    def find_completed(self, *, content_hash, exclude_case_key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT case_key FROM cases WHERE content_hash = ? AND status = 'completed' AND case_key != ?",
+                (content_hash, exclude_case_key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def file_hash(self, path):
+        # Only re-hash a file if it changed since it was journaled
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+
+        if key in self.file_hashes:
+            return self.file_hashes[key]
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT sha256 FROM files WHERE path = ? AND size = ? AND mtime_ns = ?", key
+            ).fetchone()
+
+        if row is not None:
+            digest = row[0]
+        else:
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as f:
+                while chunk := f.read(1 << 20):
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+            with self.lock, self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (*key, digest))
+
+        self.file_hashes[key] = digest
+        return digest
+
+    def content_hash(self, contents):
+        # Hash of a case: the socket slugs, file names and file contents
+        sha256 = hashlib.sha256()
+        for slug in sorted(contents):
+            for file in sorted(contents[slug]):
+                sha256.update(f"{slug}/{file.name}/{self.file_hash(file)}\n".encode())
+        return sha256.hexdigest()
+
+
+# Directory -> files within it, filled by discover_cases so nothing is listed twice
+_case_files = {}
+
+
+def discover_cases(root):
+    """
+    Discovers the cases in root/interface_*/case_*/ with a single scandir pass
+
+    Returns a list of cases, each a mapping of socket slug -> directory.
+    The files found in each socket directory are cached for prepare_contents,
+    replacing those of an earlier discovery.
+    """
+    _case_files.clear()
+    cases = []
+    for interface_dir in _scandir_sorted(root, prefix="interface_"):
+        for case_dir in _scandir_sorted(interface_dir.path, prefix="case_"):
+            case = {}
+            for relative_path, socket_dir, files in _scan_case(case_dir.path):
+                if relative_path not in SOCKET_RELATIVE_PATHS:
+                    raise RuntimeError(f"Unexpected socket location {relative_path} in {case_dir.path}")
+                case[SOCKET_RELATIVE_PATHS[relative_path]] = socket_dir
+                _case_files[socket_dir] = files
+
+            socket_set = set(case.keys())
+            assert (
+                socket_set in EXPECTED_SOCKETS
+            ), f"The input socket set {socket_set} of {case_dir.path} is unexpected and probably incorrect!"
+
+            cases.append(case)
+
+    print(f"Discovered {len(cases)} cases in {root}")
+
+    return cases
+
+
+def _scandir_sorted(path, *, prefix):
+    # Sub-directories starting with prefix, in natural order (case_2 before case_10)
+    with os.scandir(path) as it:
+        entries = [e for e in it if e.name.startswith(prefix) and e.is_dir()]
+    return sorted(entries, key=lambda e: (len(e.name), e.name))
+
+
+def _scan_case(case_path):
+    # Yields (relative path, directory, files) for each socket directory of a case
+    with os.scandir(case_path) as it:
+        kinds = [e for e in it if e.is_dir()]
+    for kind in kinds:
+        with os.scandir(kind.path) as it:
+            socket_dirs = [e for e in it if e.is_dir()]
+        for socket_dir in socket_dirs:
+            with os.scandir(socket_dir.path) as it:
+                files = sorted(Path(e.path) for e in it if e.is_file())
+            yield f"{kind.name}/{socket_dir.name}", socket_dir.path, files
+
+
+def prepare_contents(case):
+    contents = {}
+
+    socket_set = set(case.keys())
+    assert (
+        socket_set in EXPECTED_SOCKETS
+    ), f"The input socket set {socket_set} is unexpected and probably incorrect!"
+
+    for slug, file in case.items():
+        if file in _case_files:
+            files = _case_files[file]
+        else:
+            file_path = Path(file)
+            assert file_path.exists(), f"File {file} does not exist"
+            files = sorted(p for p in file_path.iterdir() if p.is_file())
+            _case_files[file] = files
+
+        if slug == "stacked-barretts-esophagus-endoscopy-images":
+            contents[slug] = files
+            assert contents[slug], f"No files found in {slug}"
+        else:
+            raise RuntimeError(f"Unexpected socket: {slug}")
+
+    return contents
@@ -0,0 +1,222 @@
+"""
+A long-lived inference worker that keeps one model warm for a stream of stacks.
+
+Stacks are submitted to an `InferenceWorker`, in-process with `submit()` or by
+dropping image files into a watched directory (`watch()`). Submitted stacks are
+preprocessed by the submitting thread and their frames are queued; a single
+batching thread collects frames across all pending requests into one batch
+until either the batch is full or the oldest queued frame has waited
+`max_latency_ms`, and then runs one forward pass for all of them (dynamic
+batching). `max_batch_size` counts the images of a forward pass, test-time
+augmented views included, like the batch_size of the model.
+
+Stopping the worker still predicts the frames that were queued before; stacks
+submitted once it stopped fail with a RuntimeError.
+
+In the watched directory, every TIFF/MHA file is one request. Producers should
+write the file elsewhere (or under another suffix) and move it in, so
+half-written files are never read. The likelihoods are written to
+<output directory>/<file stem>/stacked-neoplastic-lesion-likelihoods.json, as
+an algorithm container would, and the input is moved to processed/ (or failed/
+if it could not be predicted).
+"""
+
+import queue
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from rare25 import algorithm
+from rare25.io import find_image_files, read_frames, write_json_file
+
+
+def main(*, model, watch_directory, output_directory, ensemble_manifest=None, max_batch_size=32, max_latency_ms=50):
+    algorithm.show_torch_cuda_info()
+    classifier = algorithm.build_classifier(model=model, ensemble_manifest=ensemble_manifest)
+
+    worker = InferenceWorker(classifier=classifier, max_batch_size=max_batch_size, max_latency_ms=max_latency_ms)
+    try:
+        watch(worker=worker, watch_directory=watch_directory, output_directory=output_directory)
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        worker.stop()
+        worker.report()
+
+    return 0
+
+
+class InferenceWorker:
+    def __init__(self, *, classifier, max_batch_size=32, max_latency_ms=50):
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        # Frames per batch, every frame goes through the model once per view
+        self.max_frames = max(1, max_batch_size // _views_per_frame(classifier))
+        self.max_latency = max_latency_ms / 1000
+
+        # Items are (request, offset of the chunk in the request, preprocessed frames, time queued)
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        # Nothing is queued once stopped is set, so the batching thread can drain the queue
+        self.lock = threading.Lock()
+        self.batch_sizes = []
+        self.thread = threading.Thread(target=self._run, name="rare25-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, frames):
+        """
+        Queues the frames of one stack, returns a Future of their likelihoods
+
+        Preprocessing happens in the calling thread, so several submitting
+        threads keep the batching thread busy.
+        """
+        request = _Request(num_frames=len(frames))
+        if not len(frames):
+            request.future.set_result([])
+            return request.future
+
+        offset = 0
+        for chunk in self.classifier.preprocess_batches(frames, images_per_batch=self.max_frames):
+            with self.lock:
+                if self.stopped.is_set():
+                    request.future.set_exception(RuntimeError("The inference worker was stopped"))
+                    break
+                self.queue.put((request, offset, chunk, time.perf_counter()))
+            offset += len(chunk)
+
+        return request.future
+
+    def stop(self):
+        # Predicts what was queued before, then stops the batching thread
+        with self.lock:
+            self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        carry = None
+        while carry is not None or not (self.stopped.is_set() and self.queue.empty()):
+            if carry is not None:
+                pending, carry = [carry], None
+            else:
+                try:
+                    pending = [self.queue.get(timeout=0.1)]
+                except queue.Empty:
+                    continue
+
+            # Wait for more frames until the batch is full or the oldest frame is due
+            size = len(pending[0][2])
+            deadline = pending[0][3] + self.max_latency
+            while size < self.max_frames:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                request, offset, chunk, queued_at = item
+                space = self.max_frames - size
+                if len(chunk) > space:
+                    # Fill the batch up, the rest goes first into the next one
+                    carry = (request, offset + space, chunk[space:], queued_at)
+                    item = (request, offset, chunk[:space], queued_at)
+                pending.append(item)
+                size += len(item[2])
+
+            self._predict(pending)
+
+    def _predict(self, pending):
+        import torch
+
+        try:
+            probs = self.classifier.predict_batch(torch.cat([chunk for _, _, chunk, _ in pending])).cpu().tolist()
+        except Exception as e:
+            for request, _, _, _ in pending:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        self.batch_sizes.append(len(probs))
+        start = 0
+        for request, offset, chunk, _ in pending:
+            request.complete(offset, probs[start:start + len(chunk)])
+            start += len(chunk)
+
+    def report(self):
+        if not self.batch_sizes:
+            return
+        print(
+            f"Ran {len(self.batch_sizes)} batches of on average "
+            f"{sum(self.batch_sizes) / len(self.batch_sizes):.1f} frames (max {self.max_frames})"
+        )
+
+
+def _views_per_frame(classifier):
+    # The test-time augmented views per frame of a model, or of the ensemble member with most
+    members = getattr(classifier, "members", [classifier])
+    return max(len(getattr(member, "tta_views", ())) or 1 for member in members)
+
+
+class _Request:
+    def __init__(self, *, num_frames):
+        self.future = Future()
+        self.probs = [None] * num_frames
+        self.remaining = num_frames
+
+    def complete(self, offset, probs):
+        # Only called by the batching thread
+        if self.future.done():
+            return
+        self.probs[offset:offset + len(probs)] = probs
+        self.remaining -= len(probs)
+        if self.remaining == 0:
+            self.future.set_result(self.probs)
+
+
+def watch(*, worker, watch_directory, output_directory, poll_seconds=0.5, max_loaders=4):
+    """
+    Submits every image file that appears in the watched directory
+
+    Files are read by a pool of loader threads, so stacks that arrive together
+    are batched together.
+    """
+    watch_directory = Path(watch_directory)
+    output_directory = Path(output_directory)
+    for subdirectory in ("processed", "failed"):
+        (watch_directory / subdirectory).mkdir(parents=True, exist_ok=True)
+
+    in_flight = set()
+    lock = threading.Lock()
+
+    def serve(path):
+        start = time.perf_counter()
+        try:
+            frames = read_frames(str(path))
+            probs = worker.submit(frames).result()
+            stack_output = output_directory / path.stem
+            stack_output.mkdir(parents=True, exist_ok=True)
+            write_json_file(
+                location=stack_output / "stacked-neoplastic-lesion-likelihoods.json",
+                content=probs,
+                indent=algorithm.LIKELIHOODS_INDENT,
+            )
+            shutil.move(path, watch_directory / "processed" / path.name)
+            print(f"Predicted {len(probs)} frames of {path.name} in {time.perf_counter() - start:.2f}s")
+        except Exception:
+            print(f"Could not predict {path.name}:\n{traceback.format_exc()}")
+            shutil.move(path, watch_directory / "failed" / path.name)
+        finally:
+            with lock:
+                in_flight.discard(path)
+
+    print(f"Watching {watch_directory}, writing to {output_directory}")
+    with ThreadPoolExecutor(max_workers=max_loaders) as loaders:
+        while True:
+            for file in find_image_files(location=watch_directory):
+                path = Path(file)
+                with lock:
+                    if path in in_flight:
+                        continue
+                    in_flight.add(path)
+                loaders.submit(serve, path)
+            time.sleep(poll_seconds)
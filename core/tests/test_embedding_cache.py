@@ -0,0 +1,62 @@
+import numpy as np
+
+from rare25.embedding_cache import EmbeddingCache
+
+FEATURE_DIM = 4
+
+
+def make_cache(directory):
+    # Room for exactly 5 entries
+    return EmbeddingCache(directory, model_key="model", feature_dim=FEATURE_DIM, max_mib=5 * 4 * (FEATURE_DIM + 1) / 2**20)
+
+
+def entry(i):
+    return bytes([i]) * 16, np.full((1, FEATURE_DIM), i, np.float32), np.full((1, 1), i, np.float32)
+
+
+def put(cache, i):
+    key, features, logits = entry(i)
+    cache.put([key], features=features, logits=logits)
+
+
+def test_reload_after_partial_write(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.capacity == 5
+    for i in range(5):
+        put(cache, i)
+
+    # A crash while overwriting slot 2: it was marked empty, its new data and key never followed
+    cache.last_used[2] = 0
+    cache.last_used.flush()
+    cache.close()
+
+    cache = make_cache(tmp_path)
+    assert cache.directory == tmp_path / "model"
+    assert len(cache.entries) == 4
+    assert cache.free == [2]
+
+    # The new key takes the empty slot, not that of a live entry
+    put(cache, 9)
+    slots = list(cache.entries.values())
+    assert len(set(slots)) == len(slots)
+
+    for i in (0, 1, 3, 4, 9):
+        key, features, logits = entry(i)
+        hit, cached_features, cached_logits = cache.get([key])
+        assert hit.all()
+        np.testing.assert_array_equal(cached_features, features)
+        np.testing.assert_array_equal(cached_logits, logits)
+    assert not cache.get([entry(2)[0]])[0].any()
+    cache.close()
+
+
+def test_evicts_least_recently_used_when_full(tmp_path):
+    cache = make_cache(tmp_path)
+    for i in range(5):
+        put(cache, i)
+    cache.get([entry(0)[0]])
+    put(cache, 5)
+
+    assert not cache.get([entry(1)[0]])[0].any()
+    assert cache.get([entry(i)[0] for i in (0, 2, 3, 4, 5)])[0].all()
+    cache.close()
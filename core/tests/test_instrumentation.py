@@ -0,0 +1,34 @@
+import threading
+
+from rare25 import instrumentation
+from rare25.instrumentation import Timings
+
+
+def test_only_waits_for_the_gpu_when_profiling(monkeypatch):
+    calls = []
+    monkeypatch.setattr(instrumentation, "_synchronize_cuda", lambda: calls.append(True))
+
+    with Timings().stage("preprocessing"):
+        pass
+    assert not calls
+
+    with Timings(profile=True).stage("forward"):
+        pass
+    assert calls == [True]
+
+
+def test_stages_of_several_threads_are_all_counted():
+    timings = Timings()
+
+    def record():
+        for _ in range(1000):
+            with timings.stage("preprocessing"):
+                pass
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert timings.stages["preprocessing"]["count"] == 4000
@@ -0,0 +1,34 @@
+import numpy as np
+
+from rare25 import metrics
+from rare25.metrics import _SortedCurves, bootstrap_metrics
+
+
+def test_memmapped_sort_matches_the_in_memory_one(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    patients = rng.integers(0, 12, 500)
+    # Only odd patients have neoplasia, ties are frequent
+    y_true = rng.integers(0, 2, 500) * (patients % 2)
+    y_pred = np.round(rng.random(500), 1)
+    strata = {"Some": rng.random(500) < 0.5}
+
+    in_memory = _SortedCurves(y_true=y_true, y_pred=y_pred, patient_index=patients, num_patients=12)
+    np.random.seed(0)
+    expected = bootstrap_metrics(y_true, y_pred, patients, n_iterations=20, sample_size=2, strata=strata)
+
+    # Small chunks, so the sorted chunks are merged over several passes
+    monkeypatch.setattr(metrics, "CHUNK_FRAMES", 7)
+    memmapped = _SortedCurves(
+        y_true=y_true, y_pred=y_pred, patient_index=patients, num_patients=12, directory=tmp_path / "curves"
+    )
+    for name in ("order", "y_sorted", "tie_group", "patient_positions", "patient_offsets"):
+        np.testing.assert_array_equal(getattr(memmapped, name), getattr(in_memory, name))
+    assert isinstance(memmapped.patient_positions, np.memmap)
+
+    np.random.seed(0)
+    result = bootstrap_metrics(
+        y_true, y_pred, patients, n_iterations=20, sample_size=2, strata=strata, directory=tmp_path / "curves"
+    )
+    assert result["Score"] == expected["Score"]
+    assert result["Details"]["Strata"]["Some"]["AUROC"] == expected["Details"]["Strata"]["Some"]["AUROC"]
+    np.testing.assert_allclose(result["AUROC Full Dataset"], expected["AUROC Full Dataset"])
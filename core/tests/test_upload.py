@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("gcapi")
+
+from rare25 import archive_stand_in, upload  # noqa: E402
+
+
+def test_upload_retries_resumes_and_skips():
+    runs = archive_stand_in.try_upload(num_cases=3)
+    assert [run["exit_code"] for run in runs] == [1, 0, 0]
+
+
+def test_discover_cases_forgets_earlier_roots(tmp_path):
+    archive_stand_in.create_cases(tmp_path / "first", num_cases=1)
+    archive_stand_in.create_cases(tmp_path / "second", num_cases=2, frames=1)
+
+    upload.discover_cases(tmp_path / "first")
+    cases = upload.discover_cases(tmp_path / "second")
+
+    assert all(str(tmp_path / "second") in directory for directory in upload._case_files)
+    assert [len(files) for files in upload.prepare_contents(cases[0]).values()] == [1]
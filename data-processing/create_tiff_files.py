@@ -1,12 +1,15 @@
 import os
 import json
+import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
 # === CONFIG ===
 output_root = r'E:\RARE2025_FINAL_DATA\test-val-split'  # Same as before
 tiff_output_dir = r'E:\RARE2025_FINAL_DATA\test-val-tiff'  # New folder to store TIFF batches
-os.makedirs(tiff_output_dir, exist_ok=True)
+shard_output_dir = r'E:\RARE2025_FINAL_DATA\test-val-shards'  # Folder for the pre-decoded shards
+# 'tiff' for the batch TIFFs, 'shards' for pre-decoded memory-mapped shards, or 'both'
+output_format = 'tiff'
 batch_size = 384
 resize_dim = (512, 512)
 
@@ -14,14 +17,8 @@ def extract_patient_id(filename):
     parts = os.path.basename(filename).split('_')
     return '_'.join(parts[:2]) if len(parts) >= 2 else 'unknown'
 
-def create_batches(split):
+def list_images(split):
     image_dir = os.path.join(output_root, split)
-    metadata = {}
-    batch = []
-    batch_info = []
-    batch_start = 0
-    batch_num = 0
-
     all_images = []
     for cls in ['neo', 'ndbe']:
         cls_dir = os.path.join(image_dir, cls)
@@ -31,6 +28,17 @@ def create_batches(split):
                     'path': os.path.join(cls_dir, fname),
                     'class': cls
                 })
+    return all_images
+
+def create_batches(split):
+    os.makedirs(tiff_output_dir, exist_ok=True)
+    metadata = {}
+    batch = []
+    batch_info = []
+    batch_start = 0
+    batch_num = 0
+
+    all_images = list_images(split)
 
     for img_data in tqdm(all_images, desc=f"Processing {split} images"):
         img_path = img_data['path']
@@ -105,6 +113,77 @@ def create_batches(split):
     print(f"\nSaved {split} metadata to: {json_path}")
 
 
+def create_shards(split):
+    """
+    Writes the split pre-decoded, so loaders slice frames without decoding or copying:
+
+      {split}_frames.npy     (N, 512, 512, 3) uint8, open with np.load(..., mmap_mode='r')
+      {split}_table.npz      per frame: label (0 NDBE, 1 neoplasia), class, patient_id, filename
+      {split}_patients.json  per patient: the [start, end) range of its frames
+
+    Frames are ordered by patient, so the frames of a patient are contiguous.
+    """
+    os.makedirs(shard_output_dir, exist_ok=True)
+    all_images = sorted(
+        list_images(split),
+        key=lambda img_data: (extract_patient_id(img_data['path']), os.path.basename(img_data['path']))
+    )
+
+    frames_path = os.path.join(shard_output_dir, f"{split}_frames.npy")
+    frames = np.lib.format.open_memmap(
+        frames_path, mode='w+', dtype=np.uint8, shape=(len(all_images), resize_dim[1], resize_dim[0], 3)
+    )
+
+    table = {'label': [], 'class': [], 'patient_id': [], 'filename': []}
+    for img_data in tqdm(all_images, desc=f"Writing {split} shards"):
+        img_path = img_data['path']
+        try:
+            img = Image.open(img_path).convert('RGB')
+            img = img.resize(resize_dim, Image.LANCZOS)
+        except Exception as e:
+            print(f"Error opening image {img_path}: {e}")
+            continue
+
+        # Frames that could not be opened are skipped, the written ones stay contiguous
+        frames[len(table['filename'])] = np.asarray(img)
+        table['label'].append(0 if img_data['class'] == 'ndbe' else 1)
+        table['class'].append(img_data['class'])
+        table['patient_id'].append(extract_patient_id(img_path))
+        table['filename'].append(os.path.basename(img_path))
+
+    frames.flush()
+    written = len(table['filename'])
+    if written < len(all_images):
+        # Rewrite without the unused rows at the end, chunk by chunk
+        del frames
+        source = np.load(frames_path, mmap_mode='r')
+        trimmed_path = frames_path + '.tmp'
+        trimmed = np.lib.format.open_memmap(trimmed_path, mode='w+', dtype=np.uint8, shape=(written,) + source.shape[1:])
+        for start in range(0, written, batch_size):
+            trimmed[start:start + batch_size] = source[start:min(start + batch_size, written)]
+        trimmed.flush()
+        del source, trimmed
+        os.replace(trimmed_path, frames_path)
+
+    np.savez(
+        os.path.join(shard_output_dir, f"{split}_table.npz"),
+        label=np.array(table['label'], dtype=np.int8),
+        **{column: np.array(table[column], dtype=np.str_) for column in ('class', 'patient_id', 'filename')}
+    )
+
+    patients = {}
+    for index, patient_id in enumerate(table['patient_id']):
+        patients.setdefault(patient_id, [index, index])[1] = index + 1
+    json_path = os.path.join(shard_output_dir, f"{split}_patients.json")
+    with open(json_path, 'w') as f:
+        json.dump(patients, f, indent=2)
+
+    print(f"\nSaved {written} {split} frames of {len(patients)} patients to: {shard_output_dir}")
+
+
 # === Run for both sets ===
-create_batches('val')
-create_batches('test')
\ No newline at end of file
+for split in ['val', 'test']:
+    if output_format in ('tiff', 'both'):
+        create_batches(split)
+    if output_format in ('shards', 'both'):
+        create_shards(split)
\ No newline at end of file
@@ -1,50 +1,310 @@
 import os
+import csv
 import uuid
-import pandas as pd
-from pathlib import Path
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import copy2
 
 # Configuration
 root_dir = r"E:\RARE2025_FINAL_DATA\train"  # original dataset
 anonymized_root = r"E:\RARE2025_FINAL_DATA\train_anoniem"  # where anonymized copies will go
-output_excel = "anonymized_mapping.xlsx"
-
-# Ensure output directory exists
-os.makedirs(anonymized_root, exist_ok=True)
-
-# Collect mapping
-mappings = []
-
-for center in os.listdir(root_dir):
-    center_path = os.path.join(root_dir, center)
-    if os.path.isdir(center_path):
-        for label in os.listdir(center_path):
-            label_path = os.path.join(center_path, label)
-            if os.path.isdir(label_path):
-                for fname in os.listdir(label_path):
-                    fpath = os.path.join(label_path, fname)
-                    if os.path.isfile(fpath):
-                        ext = os.path.splitext(fname)[-1]
-                        new_name = f"{uuid.uuid4().hex}{ext}"
-
-                        # Create corresponding output directory
-                        out_dir = os.path.join(anonymized_root, center, label)
-                        os.makedirs(out_dir, exist_ok=True)
-
-                        new_path = os.path.join(out_dir, new_name)
-
-                        # Copy instead of rename
-                        copy2(fpath, new_path)
-
-                        # Save mapping
-                        mappings.append({
-                            "original_path": os.path.relpath(fpath, root_dir),
-                            "anonymized_path": os.path.relpath(new_path, anonymized_root)
-                        })
-
-# Save to Excel
-df = pd.DataFrame(mappings)
-df.to_excel(output_excel, index=False)
-
-print(f"Anonymized copies created in: {anonymized_root}")
-print(f"Mapping saved to: {output_excel}")
+output_mapping = "anonymized_mapping.csv"  # '.csv' or '.parquet' (parquet requires pyarrow; a directory of one part file per run)
+output_excel = "anonymized_mapping.xlsx"  # set to None to skip the (slow) Excel export
+link_mode = "hardlink"  # 'hardlink', 'reflink' or 'copy'; falls back to copying when unsupported
+deduplicate = False  # hash file contents and store identical files only once
+num_workers = min(32, (os.cpu_count() or 1) * 4)  # I/O bound, so more workers than cores
+parquet_row_group_size = 10_000
+incremental = True  # only process files that are not yet in the mapping, appending new rows
+# Secret salt for deterministic anonymized names, keep it private: without it names are random
+anonymization_salt = os.getenv("RARE25_ANONYMIZATION_SALT")
+
+# Linux ioctl request number for cloning a file's extents (copy-on-write)
+FICLONE = 0x40049409
+
+# Namespace for the deterministic (uuid5) anonymized names
+ANONYMIZATION_NAMESPACE = uuid.UUID("9f4d6c1e-2b7a-4f0e-8c55-3e1a2d7b9c60")
+
+
+def iter_source_files(root):
+    # Walks <root>/<center>/<label>/<file> with a single scandir pass per directory
+    with os.scandir(root) as centers:
+        for center in centers:
+            if not center.is_dir():
+                continue
+            with os.scandir(center.path) as labels:
+                for label in labels:
+                    if not label.is_dir():
+                        continue
+                    with os.scandir(label.path) as files:
+                        for entry in files:
+                            if entry.is_file():
+                                yield center.name, label.name, entry
+
+
+def hash_file(path, chunk_size=1 << 20):
+    # Content hash used for deduplication, hashlib releases the GIL on large chunks
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_key(rel_path):
+    # Mappings created on Windows use backslashes, compare paths in one form
+    return rel_path.replace("\\", "/")
+
+
+def anonymized_name(original_rel_path, ext):
+    # Same input and salt always give the same name, so re-runs are reproducible
+    if anonymization_salt:
+        key = anonymization_salt + normalize_key(original_rel_path)
+        return f"{uuid.uuid5(ANONYMIZATION_NAMESPACE, key).hex}{ext}"
+    return f"{uuid.uuid4().hex}{ext}"
+
+
+def load_mapping_index(mapping_path, excel_path):
+    """
+    Reads an existing mapping into an index of normalized original path -> row
+
+    The streamed CSV/Parquet store is preferred; the Excel file is only read
+    when no store exists yet (e.g. the first incremental run after a full export).
+    """
+    rows = []
+    if os.path.exists(mapping_path):
+        if mapping_path.lower().endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            # A directory of part files, or a single file of an earlier version
+            if os.path.isfile(mapping_path) or any(name.startswith("part-") for name in os.listdir(mapping_path)):
+                rows = pq.read_table(mapping_path).to_pylist()
+        else:
+            with open(mapping_path, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+        source = None
+    elif excel_path and os.path.exists(excel_path):
+        import pandas as pd
+
+        df = pd.read_excel(excel_path, dtype=str, keep_default_na=False)
+        rows = df.to_dict("records")
+        source = excel_path
+    else:
+        return {}, None
+
+    index = {}
+    for row in rows:
+        row.setdefault("content_hash", "")
+        index[normalize_key(row["original_path"])] = row
+    return index, source
+
+
+def reflink(src, dst):
+    # Copy-on-write clone, only supported on Linux filesystems such as btrfs and XFS
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def materialize(src, dst, mode):
+    # Creates dst from src with the cheapest supported method, returns the method used
+    if os.path.lexists(dst):
+        # Left by an interrupted run with deterministic names, whose rows never made it to the mapping
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return "existing"
+        os.remove(dst)
+
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except FileExistsError:
+            raise
+        except OSError:
+            pass  # e.g. different volume or unsupported filesystem
+    elif mode == "reflink":
+        try:
+            reflink(src, dst)
+            return "reflink"
+        except (OSError, ImportError):
+            if os.path.exists(dst):
+                os.remove(dst)
+
+    copy2(src, dst)
+    return "copy"
+
+
+class MappingWriter:
+    """
+    Streams mapping rows to a CSV or Parquet file instead of keeping them in memory
+
+    Parquet files cannot be appended to, so a Parquet mapping is a directory
+    with one part file per run, which pyarrow and pandas read as one table.
+    A part only gets its name when the run completes, until then it is hidden.
+    """
+
+    columns = ["original_path", "anonymized_path", "content_hash"]
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.is_parquet = path.lower().endswith(".parquet")
+        self.buffer = []
+        self.rows = 0
+
+        if self.is_parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if os.path.isfile(path):
+                # A single-file mapping of an earlier version becomes the first part
+                os.replace(path, path + ".old")
+                os.makedirs(path)
+                os.replace(path + ".old", os.path.join(path, "part-00000.parquet"))
+            os.makedirs(path, exist_ok=True)
+
+            parts = sorted(name for name in os.listdir(path) if name.startswith("part-"))
+            if not append:
+                for name in parts:
+                    os.remove(os.path.join(path, name))
+                parts = []
+            self.part_path = os.path.join(path, f"part-{len(parts):05d}.parquet")
+            # Hidden (leading '.') until closed, readers skip it
+            self.tmp_path = os.path.join(path, f".{os.path.basename(self.part_path)}.tmp")
+
+            self.schema = pa.schema([(c, pa.string()) for c in self.columns])
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+        else:
+            write_header = not (append and os.path.exists(path))
+            self.file = open(path, "a" if append else "w", newline="", encoding="utf-8")
+            self.writer = csv.writer(self.file)
+            if write_header:
+                self.writer.writerow(self.columns)
+
+    def write(self, row):
+        self.rows += 1
+        if self.is_parquet:
+            self.buffer.append(row)
+            if len(self.buffer) >= parquet_row_group_size:
+                self.flush()
+        else:
+            self.writer.writerow([row[c] for c in self.columns])
+
+    def flush(self):
+        if self.is_parquet and self.buffer:
+            import pyarrow as pa
+
+            table = pa.Table.from_pylist(self.buffer, schema=self.schema)
+            self.writer.write_table(table)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.is_parquet:
+            self.writer.close()
+            if self.rows:
+                os.replace(self.tmp_path, self.part_path)
+            else:
+                os.remove(self.tmp_path)
+        else:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_excel(mapping_path, excel_path):
+    # Optional final step, Excel is slow and memory-heavy for large mappings
+    import pandas as pd
+
+    if mapping_path.lower().endswith(".parquet"):
+        df = pd.read_parquet(mapping_path)
+    else:
+        df = pd.read_csv(mapping_path, keep_default_na=False)
+    df.to_excel(excel_path, index=False)
+
+
+def anonymize():
+    os.makedirs(anonymized_root, exist_ok=True)
+
+    index, index_source = load_mapping_index(output_mapping, output_excel) if incremental else ({}, None)
+    append = incremental and (index_source is None and bool(index))
+
+    seen_hashes = {  # content hash -> anonymized relative path
+        row["content_hash"]: row["anonymized_path"] for row in index.values() if row["content_hash"]
+    }
+    seen_lock = threading.Lock()
+    created_dirs = set()
+    dirs_lock = threading.Lock()
+
+    def process(center, label, entry, original_rel):
+        ext = os.path.splitext(entry.name)[-1]
+        content_hash = hash_file(entry.path) if deduplicate else ""
+
+        if deduplicate:
+            with seen_lock:
+                existing = seen_hashes.get(content_hash)
+                if existing is None:
+                    new_rel = os.path.join(center, label, anonymized_name(original_rel, ext))
+                    seen_hashes[content_hash] = new_rel
+            if existing is not None:
+                # Identical content was already stored, only record the mapping
+                return {
+                    "original_path": original_rel,
+                    "anonymized_path": existing,
+                    "content_hash": content_hash,
+                }, "duplicate"
+        else:
+            new_rel = os.path.join(center, label, anonymized_name(original_rel, ext))
+
+        # Create corresponding output directory
+        out_dir = os.path.join(anonymized_root, center, label)
+        if out_dir not in created_dirs:
+            with dirs_lock:
+                os.makedirs(out_dir, exist_ok=True)
+                created_dirs.add(out_dir)
+
+        method = materialize(entry.path, os.path.join(anonymized_root, new_rel), link_mode)
+
+        return {
+            "original_path": original_rel,
+            "anonymized_path": new_rel,
+            "content_hash": content_hash,
+        }, method
+
+    counts = {}
+    with MappingWriter(output_mapping, append=append) as writer, ThreadPoolExecutor(max_workers=num_workers) as executor:
+        if index_source is not None:
+            # Seed the store with the legacy Excel mapping so later runs only append
+            for row in index.values():
+                writer.write(row)
+
+        futures = []
+        for center, label, entry in iter_source_files(root_dir):
+            original_rel = os.path.relpath(entry.path, root_dir)
+            if normalize_key(original_rel) in index:
+                counts["already mapped"] = counts.get("already mapped", 0) + 1
+                continue
+            futures.append(executor.submit(process, center, label, entry, original_rel))
+
+        for future in as_completed(futures):
+            row, method = future.result()
+            writer.write(row)
+            counts[method] = counts.get(method, 0) + 1
+
+    print(f"Anonymized {len(futures)} new files into: {anonymized_root}")
+    for method, count in sorted(counts.items()):
+        print(f"\t{method}: {count}")
+    print(f"Mapping saved to: {output_mapping}")
+
+    if output_excel and (futures or not os.path.exists(output_excel)):
+        # Note that Excel cannot be appended to, so this rewrites the whole file
+        export_excel(output_mapping, output_excel)
+        print(f"Mapping exported to: {output_excel}")
+
+
+if __name__ == "__main__":
+    anonymize()
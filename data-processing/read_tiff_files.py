@@ -7,17 +7,18 @@ tiff_path = r"E:\RARE2025_FINAL_DATA\test-val-tiff\test_batch_0_99.tiff"  # adju
 # === Open the TIFF file ===
 img = Image.open(tiff_path)
 
-# === Read all frames (pages) ===
+# === Read the frames (pages) to show, the rest is not decoded ===
+# For training, use rare25.dataset.BatchTiffDataset, which reads any page directly
 images = []
 try:
-    while True:
+    while len(images) < 10:
         images.append(img.copy())
         img.seek(img.tell() + 1)
 except EOFError:
     pass  # Reached the last frame
 
 # === Visualize the first 10 images ===
-num_to_show = min(10, len(images))
+num_to_show = len(images)
 plt.figure(figsize=(15, 6))
 for i in range(num_to_show):
     plt.subplot(2, 5, i + 1)
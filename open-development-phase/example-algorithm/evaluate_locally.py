@@ -0,0 +1,47 @@
+"""
+Evaluates the model of inference.py end to end, without Docker.
+
+Runs the algorithm over the batch TIFFs in STACKS_DIRECTORY with one model that
+is loaded once, and then runs the evaluation of ../example-evaluation-method on
+the outputs. Set STACKS_DIRECTORY (or RARE25_STACKS_DIRECTORY) to the
+tiff_output_dir of data-processing/create_tiff_files.py: of its batches, those
+in the ground truth file of the evaluation (val_batch_*.tiff) are run. That
+file is looked up in GROUND_TRUTH_DIRECTORY. Everything is written to
+WORK_DIRECTORY, the metrics to WORK_DIRECTORY/output.
+
+  RARE25_STACKS_DIRECTORY=/path/to/test-val-tiff python evaluate_locally.py
+"""
+
+import os
+import sys
+from pathlib import Path
+
+from rare25 import local
+
+from inference import ENSEMBLE_MANIFEST, MODEL
+
+EVALUATION_METHOD_DIRECTORY = Path(__file__).resolve().parent.parent / "example-evaluation-method"
+
+STACKS_DIRECTORY = os.getenv("RARE25_STACKS_DIRECTORY")
+GROUND_TRUTH_DIRECTORY = EVALUATION_METHOD_DIRECTORY / "ground_truth"
+WORK_DIRECTORY = Path("local-evaluation")
+
+
+def main():
+    # evaluate.py is not a package, make it importable
+    sys.path.insert(0, str(EVALUATION_METHOD_DIRECTORY))
+    import evaluate
+
+    return local.main(
+        model=MODEL,
+        ensemble_manifest=ENSEMBLE_MANIFEST,
+        stacks_directory=STACKS_DIRECTORY,
+        ground_truth_directory=GROUND_TRUTH_DIRECTORY,
+        ground_truth_file=evaluate.GROUND_TRUTH_FILE,
+        work_directory=WORK_DIRECTORY,
+        evaluate=evaluate.main,
+    )
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
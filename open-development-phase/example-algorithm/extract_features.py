@@ -0,0 +1,36 @@
+"""
+Extracts the backbone features of local stacks, for fast iteration on the head.
+
+Runs the backbone of the model once over the stacks in STACKS_DIRECTORY that
+are in the ground truth metadata (val_batch_*.tiff) and stores the pooled
+features in FEATURES_DIRECTORY. Set STACKS_DIRECTORY (or RARE25_STACKS_DIRECTORY)
+to the tiff_output_dir of data-processing/create_tiff_files.py. Later runs
+reuse the features: head-only prediction and calibration against the ground
+truth metadata then take milliseconds. Runs outside of the container:
+
+  RARE25_STACKS_DIRECTORY=/path/to/test-val-tiff python extract_features.py
+"""
+
+import os
+from pathlib import Path
+
+from rare25 import features
+
+from inference import MODEL
+
+STACKS_DIRECTORY = os.getenv("RARE25_STACKS_DIRECTORY")
+FEATURES_DIRECTORY = Path("features")
+GROUND_TRUTH_FILE = Path("../example-evaluation-method/ground_truth/a_tarball_subdirectory/val_metadata.json")
+
+
+def main():
+    return features.main(
+        model=dict(model_name=MODEL["model_name"], num_classes=MODEL["num_classes"], weights=MODEL["weights"]),
+        stacks_directory=STACKS_DIRECTORY,
+        features_directory=FEATURES_DIRECTORY,
+        ground_truth_file=GROUND_TRUTH_FILE,
+    )
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
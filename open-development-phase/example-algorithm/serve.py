@@ -0,0 +1,38 @@
+"""
+Serves the model of inference.py to a stream of stacks, without Docker.
+
+Keeps the model loaded and predicts every TIFF/MHA file that is moved into
+WATCH_DIRECTORY, batching the frames of stacks that arrive together. The
+likelihoods are written to OUTPUT_DIRECTORY/<file stem>/, in the same format
+as the algorithm container. Stop it with Ctrl+C.
+
+  python serve.py
+"""
+
+from pathlib import Path
+
+from rare25 import worker
+
+from inference import ENSEMBLE_MANIFEST, MODEL
+
+WATCH_DIRECTORY = Path("serve/input")
+OUTPUT_DIRECTORY = Path("serve/output")
+
+# A batch runs once it holds MAX_BATCH_SIZE frames or its oldest frame waited MAX_LATENCY_MS
+MAX_BATCH_SIZE = 32
+MAX_LATENCY_MS = 50
+
+
+def main():
+    return worker.main(
+        model=MODEL,
+        ensemble_manifest=ENSEMBLE_MANIFEST,
+        watch_directory=WATCH_DIRECTORY,
+        output_directory=OUTPUT_DIRECTORY,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_latency_ms=MAX_LATENCY_MS,
+    )
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
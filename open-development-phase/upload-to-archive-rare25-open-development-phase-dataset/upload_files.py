@@ -8,8 +8,8 @@ phase has a designated archive. The archive is approached using its slug.
 For your challenge, and this phase it is 'rare25-open-development-phase-dataset'.
 
 Before you can run this script, you need to:
- * install gc-api (`pip install gcapi`)
- * update the EXPECTED_FILES
+ * install the shared rare25 package with gc-api (`pip install ./core[upload]`)
+ * place the cases under CASES_ROOT as interface_*/case_*/images/<socket>/
  * update the API_TOKEN with a personal token
 
 Get a token from Grand Challenge:
@@ -27,94 +27,41 @@ Check your uploaded results here:
 And the intermediate processing state here:
   https://grand-challenge.org/cases/uploads/
 
+The upload itself is done by rare25.upload (see core/ in the repository root):
+cases are discovered, uploaded concurrently with retries, and the progress is
+recorded in a local journal so an interrupted upload can simply be re-run.
+To try it against a local stand-in of the archive API, run
+`python -m rare25.archive_stand_in`.
+
 Happy uploading!
 """
 
+import os
 from pathlib import Path
 
 import gcapi
 
+from rare25 import upload
+
 
 API_TOKEN = "REPLACE-ME-WITH-YOUR-TOKEN"
 
 ARCHIVE_SLUG = "rare25-open-development-phase-dataset"
 
+# Cases are discovered in CASES_ROOT/interface_*/case_*/<relative path of the socket>
+CASES_ROOT = Path(os.getenv("UPLOAD_CASES_ROOT", Path(__file__).parent))
 
-EXPECTED_CASE_FILES_FOR_INTERFACE_0 = [
-    {
-        "stacked-barretts-esophagus-endoscopy-images": "open-development-phase/upload-to-archive-rare25-open-development-phase-dataset/interface_0/case_0/images/stacked-barretts-esophagus-endoscopy",
-    },
-    {
-        "stacked-barretts-esophagus-endoscopy-images": "open-development-phase/upload-to-archive-rare25-open-development-phase-dataset/interface_0/case_1/images/stacked-barretts-esophagus-endoscopy",
-    },
-    {
-        "stacked-barretts-esophagus-endoscopy-images": "open-development-phase/upload-to-archive-rare25-open-development-phase-dataset/interface_0/case_2/images/stacked-barretts-esophagus-endoscopy",
-    },
-]
-
-
-EXPECTED_CASES = [
-    *EXPECTED_CASE_FILES_FOR_INTERFACE_0,
-]
-
-EXPECTED_SOCKETS = [
-    {
-        "stacked-barretts-esophagus-endoscopy-images",
-    },
-]
+# Local journal that records the upload state of each case
+JOURNAL_PATH = Path(os.getenv("UPLOAD_JOURNAL_PATH", Path(__file__).parent / "upload_journal.sqlite3"))
 
 
 def main():
-    pre_flight_check()
-    upload_files()
-    return 0
-
-
-def pre_flight_check():
-    # Perform a sanity-check to see if everything is in place
-    # before we start uploading files to the archive
-
-    for case in EXPECTED_CASES:
-        prepare_contents(case)
-
-
-def upload_files():
-    # Uploads files to the Grand-Challenge archive
-
-    client = gcapi.Client(token=API_TOKEN)
-    archive = client.archives.detail(slug=ARCHIVE_SLUG)
-    archive_api_url = archive["api_url"]
-
-    for case in EXPECTED_CASES:
-        print(f"Uploading {case} to {archive['title']}")
-
-        contents = prepare_contents(case)
-        archive_item = client.archive_items.create(archive=archive_api_url, values=[])
-        client.update_archive_item(
-            archive_item_pk=archive_item["pk"],
-            values=contents,
-        )
-
-
-def prepare_contents(case):
-    contents = {}
-
-    socket_set = set(case.keys())
-    assert (
-        socket_set in EXPECTED_SOCKETS
-    ), f"The input socket set {socket_set} is unexpected and probably incorrect!"
-
-    for slug, file in case.items():
-        file_path = Path(file)
-        assert file_path.exists(), f"File {file} does not exist"
-
-        if slug == "stacked-barretts-esophagus-endoscopy-images":
-            contents[slug] = list(file_path.rglob("*"))
-            assert contents[slug], f"No files found in {slug}"
-        else:
-            raise RuntimeError(f"Unexpected socket: {key}")
-
-    return contents
+    return upload.main(
+        client=gcapi.Client(token=API_TOKEN),
+        archive_slug=ARCHIVE_SLUG,
+        cases_root=CASES_ROOT,
+        journal_path=JOURNAL_PATH,
+    )
 
 
 if __name__ == "__main__":
@@ -15,6 +15,10 @@ To save the container and prep it for upload to Grand-Challenge.org you can call
 
 Any container that shows the same behaviour will do, this is purely an example of how one COULD do it.
 
+The shared code lives in the rare25 package (see core/ in the repository root).
+This sanity-check phase only verifies the submission pipeline, so it writes
+placeholder predictions instead of running a model.
+
 Reference the documentation to get details on the runtime environment on the platform:
 https://grand-challenge.org/documentation/runtime-environment/
 
@@ -22,27 +26,18 @@ Happy programming!
 """
 
 from pathlib import Path
-import json
-from glob import glob
-import SimpleITK
-import numpy
 
-INPUT_PATH = Path("/input")
-OUTPUT_PATH = Path("/output")
-RESOURCE_PATH = Path("resources")
+from rare25 import INTERFACE_0, algorithm
+from rare25.algorithm import INPUT_PATH, OUTPUT_PATH, show_torch_cuda_info
+from rare25.io import load_image_file_as_array, write_json_file
 
 
 def run():
-    # The key is a tuple of the slugs of the input sockets
-    interface_key = get_interface_key()
-
-    # Lookup the handler for this particular set of sockets (i.e. the interface)
-    handler = {
-        ("stacked-barretts-esophagus-endoscopy-images",): interface_0_handler,
-    }[interface_key]
-
-    # Call the handler
-    return handler()
+    return algorithm.run(
+        handlers={
+            INTERFACE_0: interface_0_handler,
+        }
+    )
 
 
 def interface_0_handler():
@@ -52,7 +47,7 @@ def interface_0_handler():
     )
 
     # Process the inputs: any way you'd like
-    _show_torch_cuda_info()
+    show_torch_cuda_info()
 
     # Some additional resources might be required, include these in one of two ways.
 
@@ -80,53 +75,5 @@ def interface_0_handler():
     return 0
 
 
-def get_interface_key():
-    # The inputs.json is a system generated file that contains information about
-    # the inputs that interface with the algorithm
-    inputs = load_json_file(
-        location=INPUT_PATH / "inputs.json",
-    )
-    socket_slugs = [sv["interface"]["slug"] for sv in inputs]
-    return tuple(sorted(socket_slugs))
-
-
-def load_json_file(*, location):
-    # Reads a json file
-    with open(location, "r") as f:
-        return json.loads(f.read())
-
-
-def write_json_file(*, location, content):
-    # Writes a json file
-    with open(location, "w") as f:
-        f.write(json.dumps(content, indent=4))
-
-
-def load_image_file_as_array(*, location):
-    # Use SimpleITK to read a file
-    input_files = (
-        glob(str(location / "*.tif"))
-        + glob(str(location / "*.tiff"))
-        + glob(str(location / "*.mha"))
-    )
-    result = SimpleITK.ReadImage(input_files[0])
-
-    # Convert it to a Numpy array
-    return SimpleITK.GetArrayFromImage(result)
-
-
-def _show_torch_cuda_info():
-    import torch
-
-    print("=+=" * 10)
-    print("Collecting Torch CUDA information")
-    print(f"Torch CUDA is available: {(available := torch.cuda.is_available())}")
-    if available:
-        print(f"\tnumber of devices: {torch.cuda.device_count()}")
-        print(f"\tcurrent device: { (current_device := torch.cuda.current_device())}")
-        print(f"\tproperties: {torch.cuda.get_device_properties(current_device)}")
-    print("=+=" * 10)
-
-
 if __name__ == "__main__":
     raise SystemExit(run())
@@ -22,23 +22,32 @@ To save the container and prep it for upload to Grand-Challenge.org you can call
 
 Any container that shows the same behaviour will do, this is purely an example of how one COULD do it.
 
+The shared code lives in the rare25 package (see core/ in the repository root).
+This sanity-check phase only verifies the submission pipeline, so it reports
+a placeholder metric instead of the leaderboard metrics.
+
 Reference the documentation to get details on the runtime environment on the platform:
 https://grand-challenge.org/documentation/runtime-environment/
 
 Happy programming!
 """
 
-import json
-
-
 import random
 from statistics import mean
 from pathlib import Path
-from pprint import pformat, pprint
-from helpers import run_prediction_processing, tree
+from pprint import pformat
 
-INPUT_DIRECTORY = Path("/input")
-OUTPUT_DIRECTORY = Path("/output")
+from rare25 import INTERFACE_0
+from rare25.evaluation import (
+    get_file_location,
+    get_image_name,
+    get_interface_key,
+    print_inputs,
+    read_predictions,
+    write_metrics,
+)
+from rare25.io import load_json_file
+from rare25.processing import run_prediction_processing
 
 
 def main():
@@ -73,7 +82,7 @@ def process(job):
 
     # Lookup the handler for this particular set of sockets (i.e. the interface)
     handler = {
-        ("stacked-barretts-esophagus-endoscopy-images",): process_interface_0,
+        INTERFACE_0: process_interface_0,
     }[interface_key]
 
     # Call the handler
@@ -134,65 +143,5 @@ def process_interface_0(
     }
 
 
-def print_inputs():
-    # Just for convenience, in the logs you can then see what files you have to work with
-    print("Input Files:")
-    for line in tree(INPUT_DIRECTORY):
-        print(line)
-    print("")
-
-
-def read_predictions():
-    # The prediction file tells us the location of the users' predictions
-    return load_json_file(location=INPUT_DIRECTORY / "predictions.json")
-
-
-def get_interface_key(job):
-    # Each interface has a unique key that is the set of socket slugs given as input
-    socket_slugs = [sv["interface"]["slug"] for sv in job["inputs"]]
-    return tuple(sorted(socket_slugs))
-
-
-def get_image_name(*, values, slug):
-    # This tells us the user-provided name of the input or output image
-    for value in values:
-        if value["interface"]["slug"] == slug:
-            return value["image"]["name"]
-
-    raise RuntimeError(f"Image with interface {slug} not found!")
-
-
-def get_interface_relative_path(*, values, slug):
-    # Gets the location of the interface relative to the input or output
-    for value in values:
-        if value["interface"]["slug"] == slug:
-            return value["interface"]["relative_path"]
-
-    raise RuntimeError(f"Value with interface {slug} not found!")
-
-
-def get_file_location(*, job_pk, values, slug):
-    # Where a job's output file will be located in the evaluation container
-    relative_path = get_interface_relative_path(values=values, slug=slug)
-    return INPUT_DIRECTORY / job_pk / "output" / relative_path
-
-
-def load_json_file(*, location):
-    # Reads a json file
-    with open(location) as f:
-        return json.loads(f.read())
-
-
-def write_metrics(*, metrics):
-    # Write a json document used for ranking results on the leaderboard
-    write_json_file(location=OUTPUT_DIRECTORY / "metrics.json", content=metrics)
-
-
-def write_json_file(*, location, content):
-    # Writes a json file
-    with open(location, "w") as f:
-        f.write(json.dumps(content, indent=4))
-
-
 if __name__ == "__main__":
     raise SystemExit(main())